@@ -12,8 +12,27 @@
             Close the display device defined by 'imtdev'. This must
             be done before resetting the display buffer to a new size.
 
-        display(pix, name=None, bufname=None, z1=None, z2=None, quiet=False, transform=None, scale=None, offset=None, frame=None)::
+        display(pix, name=None, bufname=None, z1=None, z2=None, quiet=False, transform=None, scale=None, offset=None, frame=None, fit=None, binning='mean', cache=False)::
             Display the scaled array in display tool (ds9/ximtool/...).
+            With fit='bin', images larger than the frame buffer are
+            reduced by an integer factor instead of being trimmed.
+            With cache=True, redisplaying an unchanged array reuses its
+            scaled image.
+
+        pan(x, y)::
+            Redisplay the last displayed image, centered on its pixel (x, y),
+            at the current zoom level (or block factor, see fit='bin').
+
+        zoom(level, x=None, y=None)::
+            Redisplay the last displayed image reduced by 2**level (0 is
+            full resolution), centered on pixel (x, y) or on the current
+            center.  The byte-scaled image is cached at each level, so
+            only parts of the image never shown before get scaled.
+
+        release()::
+            Forget the last displayed image, which pan and zoom otherwise
+            keep a reference to (images displayed from a file name are
+            opened again instead), and the tiles scaled from it.
 
         readcursor(sample=0)::
             Return a single cursor position from the image display.
@@ -87,8 +106,12 @@ from __future__ import absolute_import, division, print_function # confidence me
 from .version import *
 
 import numpy as n
-import math, string
+import math, os, string, zlib
+from collections import OrderedDict
 from . import displaydev
+from . import imfile
+from . import pyramid
+from . import tiles
 from . import zscale as _zscale
 
 try:
@@ -96,6 +119,14 @@ try:
 except ImportError:
     geotrans = None
 
+# Images are byte-scaled a few rows at a time, through a float64 scratch
+# buffer holding about this many pixels (2 MB).
+_SCALE_CHUNK = 262144
+
+# The display cache fingerprints arrays by a checksum of a grid of at most
+# this many pixels on a side.
+_CACHE_GRID = 64
+
 
 class NumDisplay(object):
     """ Class to manage the attributes and methods necessary for displaying
@@ -111,6 +142,10 @@ class NumDisplay(object):
 
             display(pix, name=None, bufname=None):
 
+            pan(x, y):
+            zoom(level, x=None, y=None):
+            release():
+
             readcursor():
 
     """
@@ -141,6 +176,28 @@ class NumDisplay(object):
         self.z2 = None
 
         self.name = None
+        # number of threads used on large images (None: one per CPU)
+        self.nthreads = None
+        # uint8 output buffer reused by _bscaleImage
+        self._bbuf = None
+        # pixel range used to clip the input array when zrange is set
+        self._zclip = None
+        # (settings, table) of the last lookup table built for integer images
+        self._lut = None
+        # What pan and zoom need of the last displayed image (see
+        # _viewSource), its pyramids of scaled tiles keyed by their base
+        # block factor, the (frame, name, z1, z2) it was displayed with,
+        # the block factor and center of the view, and the (block, x0, y0)
+        # of the last view sent by pan or zoom.
+        self._viewsource = None
+        self._pyramids = {}
+        self._pyrview = None
+        self._block = 1
+        self._center = None
+        self._lastview = None
+        # Most recently used display results, see _cacheKey
+        self.cachesize = 4
+        self._cache = OrderedDict()
         self.view = displaydev._display
         self.handle = self.view.getHandle()
 
@@ -219,41 +276,139 @@ class NumDisplay(object):
         """
         return image
 
-    def _bscaleImage(self, image):
+    def _byteBuffer(self, shape):
+        """ Return the reusable uint8 output buffer, reshaped to 'shape'.
+            The memory is only reallocated when it has to grow.
+        """
+        _size = int(n.prod(shape))
+        if self._bbuf is None or self._bbuf.size < _size:
+            self._bbuf = n.empty(_size, dtype=n.uint8)
+        return self._bbuf[:_size].reshape(shape)
+
+    def _bscaleImage(self, image, out=None):
         """
         This function converts the input image into a byte-array
          with the z1/z2 values being mapped from 1 - 200.
-         It also returns a status message to report on success or failure.
+
+         The image is scaled a few rows at a time in a small float64
+         scratch buffer, and written straight into the uint8 array 'out'
+         (by default, a buffer reused from one call to the next), so no
+         full-size temporaries are created.
 
         """
         _pmin = 1.
         _pmax = 200.
         _ny,_nx = image.shape
 
-        bimage = n.zeros((_ny,_nx),dtype=n.uint8)
+        if out is None:
+            out = self._byteBuffer((_ny,_nx))
+        bimage = out
         iz1 = self.z1
         iz2 = self.z2
 
         if iz2 == iz1:
-            status = "Image scaled to all one pixel value!"
+            # Image scaled to all one pixel value!
+            bimage[...] = 0
             return bimage
         else:
             scale =  (_pmax - _pmin) / (iz2 - iz1)
 
         # Now we can scale the pixels using a linear scale only (for now)
         # Scale the pixel values:  iz1 --> _pmin, iz2 --> _pmax
-        bimage = (image - iz1) * scale + _pmin
-        bimage = n.clip(bimage,_pmin,_pmax)
-        bimage = n.array(bimage,dtype=n.uint8)
+        _nlines = max(1, min(_ny, _SCALE_CHUNK // max(_nx, 1)))
+        _scratch = n.empty((_nlines,_nx), dtype=n.float64)
+        for _y0 in range(0, _ny, _nlines):
+            _y1 = min(_y0 + _nlines, _ny)
+            _tmp = _scratch[:_y1 - _y0]
+            n.subtract(image[_y0:_y1], iz1, out=_tmp, dtype=n.float64)
+            _tmp *= scale
+            _tmp += _pmin
+            n.clip(_tmp, _pmin, _pmax, out=_tmp)
+            bimage[_y0:_y1] = _tmp
 
-        status = 'Image scaled to Z1: '+repr(iz1)+' Z2: '+repr(iz2)+'...'
         return bimage
 
 
-    def _fbclipImage(self,pix,fbwidth,fbheight):
+    def _lookupTable(self, dtype, transform=True):
+        """ Return the uint8 lookup table giving the display value of every
+            value of the (8 or 16-bit) integer type 'dtype', indexed by the
+            unsigned integer with the same bits.
+
+            Each value goes through exactly the same clip, offset, scale,
+            transform (unless transform=False) and byte scaling as the
+            pixels themselves would.  The table is cached and only rebuilt
+            when dtype or any of these settings change.
+        """
+        _key = (dtype.newbyteorder('=').str, transform, self.zrange,
+                self._zclip, self.z1, self.z2, self.transform, self.offset,
+                self.scale)
+        if self._lut is not None and self._lut[0] == _key:
+            return self._lut[1]
+
+        _nvalues = 1 << (8 * dtype.itemsize)
+        _values = n.arange(_nvalues, dtype='u%d' % dtype.itemsize)
+        _values = _values.view(dtype.newbyteorder('=')).reshape(1,_nvalues)
+        # Values which no pixel may have can overflow; ignore that
+        _err = n.seterr(all='ignore')
+        try:
+            if transform:
+                _values = self._transformImage(_values)
+            lut = self._bscaleImage(_values,
+                                    out=n.empty((1,_nvalues), n.uint8))
+        finally:
+            n.seterr(**_err)
+        lut = lut.reshape(_nvalues)
+        self._lut = (_key, lut)
+        return lut
+
+    def _applyLookupTable(self, lut, image):
+        """ Map the integer image through lut into the uint8 output buffer,
+            in row tiles spread over self.nthreads threads.
+        """
+        bimage = self._byteBuffer(image.shape)
+        # Index the table by the unsigned integers with the same bits,
+        # keeping the byte order of the image.
+        _index = image.view(image.dtype.byteorder + 'u%d' % image.itemsize)
+
+        def _taketile(tile):
+            _y0,_y1 = tile
+            n.take(lut, _index[_y0:_y1], out=bimage[_y0:_y1], mode='clip')
+
+        tiles.maptiles(_taketile, tiles.rowtiles(image.shape), self.nthreads,
+                       image.size)
+        return bimage
+
+    def _scaleImage(self, image, transform=True):
+        """ Transform (unless transform=False) and bytescale image into the
+            uint8 output buffer.
+
+            The work is done in row tiles, spread over self.nthreads
+            threads for large images, each tile writing into its own slice
+            of the output buffer.  The transform is therefore applied to
+            one tile at a time, and has to work pixel by pixel, as numpy
+            ufuncs do.
+        """
+        bimage = self._byteBuffer(image.shape)
+
+        def _scaletile(tile):
+            _y0,_y1 = tile
+            _tile = image[_y0:_y1]
+            if transform:
+                _tile = self._transformImage(_tile)
+            self._bscaleImage(_tile, out=bimage[_y0:_y1])
+
+        tiles.maptiles(_scaletile, tiles.rowtiles(image.shape), self.nthreads,
+                       image.size)
+        return bimage
+
+    def _fbsection(self,shape,fbwidth,fbheight):
+        """ Return the (rows, columns) slices of the section of an image of
+            the given shape which fits in a fbwidth x fbheight frame buffer,
+            centered on the image.
+        """
 
         # Get the image parameters
-        _ny,_nx = pix.shape
+        _ny,_nx = shape
 
         if _nx > fbwidth or _ny > fbheight:
 
@@ -274,11 +429,53 @@ class NumDisplay(object):
         _ystart = max(_ly, 0)
         _yend = max( (_ly + _ny), _ny)
 
+        return slice(_ystart,_yend), slice(_xstart,_xend)
+
+    def _fbclipImage(self,pix,fbwidth,fbheight,lut=None,transform=True):
+        """ Return the bytescaled section of the (untransformed) image pix
+            which fits in a fbwidth x fbheight frame buffer, centered on
+            the image.
+
+            Only that section is transformed (unless transform=False) and
+            bytescaled, or mapped through the integer lookup table lut.
+        """
+
         # Return bytescaled, frame-buffer trimmed image
-        if (_xstart == 0 and _xend == pix.shape[0]) and (_ystart == 0 and _yend == pix.shape[1]):
-            return self._bscaleImage(pix)
-        else:
-            return self._bscaleImage(pix[_ystart:_yend,_xstart:_xend])
+        _section = pix[self._fbsection(pix.shape,fbwidth,fbheight)]
+        if lut is not None:
+            return self._applyLookupTable(lut, _section)
+        return self._scaleImage(_section, transform=transform)
+
+    def _binImage(self, pix, factor, method='mean'):
+        """ Return the image pix reduced by an integer factor in both axes,
+            by taking the mean or the median of each factor x factor block
+            of pixels, or by sampling the pixel closest to its center
+            (method='sample').  Rows and columns left over at the end of
+            the image are dropped.
+        """
+
+        _ny = pix.shape[0] // factor
+        _nx = pix.shape[1] // factor
+        if method == 'sample':
+            _s = factor // 2
+            return n.asarray(pix[_s:_ny*factor:factor, _s:_nx*factor:factor])
+        if method not in ('mean', 'median'):
+            raise ValueError("Unknown binning method `%s'" % method)
+
+        def _bintile(tile):
+            # Only this band of rows is read, for memmaps and lazy images
+            _nrows = tile[1] - tile[0]
+            _band = n.asarray(pix[tile[0]*factor:tile[1]*factor, :_nx*factor])
+            _band = _band.reshape(_nrows, factor, _nx, factor)
+            if method == 'mean':
+                return _band.mean(axis=3).mean(axis=1)
+            _band = _band.swapaxes(1, 2).reshape(_nrows, _nx, factor*factor)
+            return n.median(_band, axis=2)
+
+        _npix = _ny * _nx * factor * factor
+        _tiles = tiles.rowtiles((_ny, _nx * factor * factor))
+        return n.concatenate(tiles.maptiles(_bintile, _tiles, self.nthreads,
+                                            _npix))
 
     def _transformImage(self, pix):
         """ Apply user-specified scaling to the input array. """
@@ -286,8 +483,8 @@ class NumDisplay(object):
         if isinstance(pix,n.ndarray):
 
             if self.zrange:
-                zpix = pix.copy()
-                zpix = n.clip(pix,self.z1,self.z2)
+                _z1,_z2 = self._zclip or (self.z1,self.z2)
+                zpix = n.clip(pix,_z1,_z2)
             else:
                 zpix = pix
         else:
@@ -307,7 +504,8 @@ class NumDisplay(object):
 
     def display(self, pix, name=None, bufname=None, z1=None, z2=None,
              transform=None, zscale=False, contrast=0.25, scale=None,
-             offset=None, frame=None,quiet=False):
+             offset=None, frame=None,quiet=False, fit=None, binning='mean',
+             cache=False):
 
         """ Displays byte-scaled (UInt8) n to XIMTOOL device.
         This method uses the IIS protocol for displaying the data
@@ -319,6 +517,16 @@ class NumDisplay(object):
 
         Parameters
         ----------
+        pix : array or str
+            2-d array to display; it is not copied, so a view, a slice, a
+            memmap or a non-native byte order array can be passed as is.
+            A file name (.npy or FITS file) is opened as a memmap with
+            imfile.openImage; raw image files can be opened with
+            imfile.openImage(filename, shape, dtype) and passed as arrays.
+            Any other object with shape, dtype and __getitem__ (such as an
+            HDF5 dataset) is only asked for the slices which get displayed
+            or sampled by zscale.
+
         name : str
             optional name to pass along for identifying array
 
@@ -331,10 +539,14 @@ class NumDisplay(object):
 
         z1,z2 : float
             minimum/maximum pixel value to display. Not specifying values will default
-            to the full range values of the input array.
+            to the full range values of the input array (of the displayed
+            section, for memmaps and lazy images, so that the rest of the
+            image is never read).
 
         transform : function
-            Python function to apply to array (function)
+            Python function to apply to array (function).  Large images
+            are transformed in tiles, so it has to work pixel by pixel
+            (as numpy ufuncs such as numpy.log do).
 
         zscale : bool
             Specify whether or not to use an algorithm like that in the IRAF
@@ -362,15 +574,61 @@ class NumDisplay(object):
         quiet : bool (Default: False)
             if True, this parameter will turn off all status messages
 
+        fit : str (Default: None)
+            how to display images larger than the frame buffer: None to
+            display the central section which fits, 'bin' to reduce the
+            whole image by the smallest integer factor which makes it fit
+            in the largest frame buffer (or in bufname).  The WCS sent to
+            the display maps the reduced image back onto the original
+            pixels.
+
+        binning : str (Default: 'mean')
+            with fit='bin', how each block of pixels is reduced: 'mean',
+            'median', or 'sample' (the pixel nearest to its center)
+
+        cache : bool (Default: False)
+            if True, the scaled frame buffer image is kept (for the last
+            self.cachesize displays), and displaying the same array with
+            the same parameters again with cache=True just sends it.
+            Arrays are recognized by their address and layout and a
+            checksum of a sparse grid of pixels only, so pixels changed in
+            place elsewhere are NOT noticed: only use the cache for arrays
+            which do not change.  Each entry keeps a reference to the
+            array (for pan and zoom) and a copy of the scaled frame buffer
+            image (one byte per frame buffer pixel).
+
         Notes
         ------
         The display parameters set here will ONLY apply to the display
         of the current array.
 
+        A reference to pix is kept (unless it is a file name, which is
+        opened again) so that pan and zoom can show other parts of it,
+        until the next display or release().
+
         """
 
-        #Ensure that the input array 'pix' is a numpy array
-        pix = n.array(pix)
+        if fit not in (None, 'bin'):
+            raise ValueError("Unknown fit mode `%s'" % fit)
+        if binning not in ('mean', 'median', 'sample'):
+            raise ValueError("Unknown binning method `%s'" % binning)
+
+        # Images stored in files are memory mapped, so that only the
+        # displayed section and the rows sampled by zscale get read.
+        _path = None
+        if isinstance(pix, str):
+            if name is None:
+                name = os.path.basename(pix)
+            _path = pix
+            pix = imfile.openImage(pix)
+
+        # Ensure that the input array 'pix' is a numpy array, without copying
+        # it: views, memmaps and byte-swapped arrays are used as they are,
+        # and only the displayed section gets read by the scaling.  Lazy
+        # images (see imfile.isLazyImage) are only ever sliced.
+        _paged = imfile.isLazyImage(pix)
+        if not _paged:
+            pix = n.asarray(pix)
         self.z1 = z1
         self.z2 = z2
 
@@ -386,6 +644,20 @@ class NumDisplay(object):
                     print("transform disallowed when zscale=True")
                 transform = None
 
+        # Look for the result of displaying the same array with the same
+        # (effective) parameters in the display cache.
+        _key = _entry = None
+        if cache and self.cachesize > 0 and isinstance(pix, n.ndarray):
+            _key = self._cacheKey(pix, (z1, z2, zscale,
+                        zscale and contrast, transform or self.transform,
+                        self.scale if scale is None else scale,
+                        self.offset if offset is None else offset,
+                        name, bufname, fit, binning))
+            _entry = self._cacheGet(_key)
+
+        if _entry is not None:
+            z1, z2 = _entry['zset']
+        elif zscale:
             z1, z2 = _zscale.zscale(pix, contrast=contrast)
 
         self.set(frame=frame, z1=z1, z2=z2,
@@ -397,12 +669,9 @@ class NumDisplay(object):
         _d = self.view._display
         self.handle = _d.getHandle()
 
-        # If no user specified values are provided, interrogate the array itself
-        # for the full range of pixel values
-        if self.z1 == None:
-            self.z1 = n.minimum.reduce(n.ravel(pix))
-        if self.z2 == None:
-            self.z2 = n.maximum.reduce(n.ravel(pix))
+        if _entry is not None:
+            self._displayCached(_d, _entry, quiet)
+            return
 
         # If the user has not selected a specific buffer for the display,
         # select and set the frame buffer size based on input image size.
@@ -412,20 +681,72 @@ class NumDisplay(object):
         else:
             useiraf = False
 
+        _image = pix
+        _ny,_nx = pix.shape
+        _fitlargest = False
         if bufname != None:
             _d.setFBconfig(None,bufname=bufname)
+        elif fit == 'bin' and not (useiraf and _d.fbname is not None):
+            _fitlargest = True
+            # Start from the largest frame buffer, so that the image gets
+            # reduced as little as possible.
+            _fbsizes = [(fb['width'] * fb['height'], num)
+                        for num, fb in _d.fbdict.items()]
+            _d.setFBconfig(max(_fbsizes)[1])
         else:
-            _ny,_nx = pix.shape
             _d.selectFB(_nx,_ny,reset=1,useiraf=useiraf)
 
-        # Initialize the specified frame buffer
+        # Reduce an image which is too large for the frame buffer by the
+        # smallest integer factor which makes it fit, then select the frame
+        # buffer which best matches the reduced image.
+        _block = 1
+        if fit == 'bin':
+            _block = max(1, -(-_nx // _d.fbwidth), -(-_ny // _d.fbheight))
+        if _block == 1 and _fitlargest:
+            # The image fits as it is: use the buffer which matches it
+            _d.selectFB(_nx,_ny,reset=1,useiraf=useiraf)
+        elif _block > 1:
+            pix = self._binImage(pix, _block, binning)
+            _paged = False
+            if bufname == None:
+                _ny,_nx = pix.shape
+                _d.selectFB(_nx,_ny,reset=1,useiraf=useiraf)
+
+        # For memory mapped and lazy images, only the section which fits in
+        # the frame buffer is read (once), and it is used in place of the
+        # whole image.
+        if _paged:
+            _src = n.asarray(pix[self._fbsection(pix.shape, _d.fbwidth,
+                                                    _d.fbheight)])
+        else:
+            _src = pix
+
+        # If no user specified values are provided, interrogate the array itself
+        # for the full range of pixel values.  The range is computed at most
+        # once per display, in a single pass over the array.
+        _pixrange = None
+        if self.z1 == None or self.z2 == None:
+            _pixrange = tiles.minmax(_src, self.nthreads)
+        if self.z1 == None:
+            self.z1 = _pixrange[0]
+        if self.z2 == None:
+            self.z2 = _pixrange[1]
+
+        # Initialize the specified frame buffer (it gets erased by _sendFrame
+        # only if needed)
         _d.setFrame(self.frame)
-        _d.eraseFrame()
 
-        # Apply user specified scaling to image, returns original
-        # if none are specified.
+        # Integer images of up to 16 bits are scaled through a lookup table
+        # built from all of their possible values, rather than transforming
+        # every pixel.
+        _uselut = (_src.dtype.kind in 'ui' and _src.dtype.itemsize <= 2 and
+                   _src.size >= (1 << (8 * _src.dtype.itemsize)))
+        _transformed = True
 
-        bpix = self._transformImage(pix)
+        # User specified scaling is only applied to the section of the
+        # image which fits in the frame buffer (see _fbclipImage); these
+        # are the limits that the input array gets clipped to.
+        self._zclip = (self.z1, self.z2)
 
         # Recompute the pixel range of (possibly) transformed array
         _z1 = self._transformImage(self.z1)
@@ -436,9 +757,10 @@ class NumDisplay(object):
         if _z1 == _z2:
             if not quiet:
                 print('Error encountered during transformation. No transformation applied...')
-            bpix = pix
-            self.z1 = n.minimum.reduce(n.ravel(bpix))
-            self.z2 = n.maximum.reduce(n.ravel(bpix))
+            _transformed = False
+            if _pixrange is None:
+                _pixrange = tiles.minmax(_src, self.nthreads)
+            self.z1,self.z2 = _pixrange
             # Failsafe in case input image is flat:
             if self.z1 == self.z2:
                 self.z1 -= 1.
@@ -451,22 +773,289 @@ class NumDisplay(object):
             self.z1 = _z1
             self.z2 = _z2
 
-        _wcsinfo = displaydev.ImageWCS(bpix,z1=self.z1,z2=self.z2,name=name)
+        _wcsinfo = displaydev.ImageWCS(pix,z1=self.z1,z2=self.z2,name=name)
+        if _block > 1:
+            _wcsinfo.block = _block
+            _wcsinfo.blockorigin = self._blockOrigin(_block, binning)
         if not quiet:
             print('Image displayed with Z1: ',self.z1,' Z2:',self.z2)
 
-        bpix = self._fbclipImage(bpix,_d.fbwidth,_d.fbheight)
+        if _uselut:
+            _lut = self._lookupTable(_src.dtype, transform=_transformed)
+        else:
+            _lut = None
+        bpix = self._fbclipImage(_src,_d.fbwidth,_d.fbheight,lut=_lut,
+                                 transform=_transformed)
 
         # Update the WCS to match the frame buffer being used.
         _d.syncWCS(_wcsinfo)
 
-        # write out WCS to frame buffer, then erase buffer
-        _d.writeWCS(_wcsinfo)
-
-        # Now, send the trimmed image (section) to the display device
-        _d.writeImage(bpix,_wcsinfo)
+        # Now, send the WCS and the trimmed image (section) to the display
+        # device
+        _digest = self._sendFrame(_d, bpix, _wcsinfo)
         #displaydev.close()
 
+        # Other views of the image (see pan and zoom) are scaled from tiles
+        # of the image itself, with the current settings.
+        if _path is not None:
+            _source = lambda: imfile.openImage(_path)
+        else:
+            _source = lambda: _image
+        _views = (self._viewSource(_source, _image.shape, _block, binning,
+                                   _lut, _src.dtype, _transformed), {})
+        self._setViews(_views, (_d.frame, name, self.z1, self.z2))
+
+        if _key is not None:
+            self._cacheStore(_key, {'zset': (z1, z2), 'z1': self.z1,
+                                    'z2': self.z2, 'fbconfig': _d.fbconfig,
+                                    'wcs': _wcsinfo, 'bpix': n.array(bpix),
+                                    'digest': _digest, 'views': _views})
+
+    def _cacheKey(self, pix, settings):
+        """ Return the display cache key of the array pix displayed with the
+            given settings: a cheap fingerprint of the array (its identity,
+            address, layout and a checksum of a grid of sampled pixels),
+            followed by the settings.
+        """
+        _ny,_nx = pix.shape
+        _sample = pix[::max(1, _ny // _CACHE_GRID), ::max(1, _nx // _CACHE_GRID)]
+        _crc = zlib.crc32(n.ascontiguousarray(_sample).tobytes()) & 0xffffffff
+        return ((id(pix), pix.__array_interface__['data'][0], pix.shape,
+                 pix.strides, pix.dtype.str, _crc) + tuple(settings))
+
+    def _cacheGet(self, key):
+        """ Return the display cache entry for key (or None), marking it as
+            the most recently used one.
+        """
+        _entry = self._cache.pop(key, None)
+        if _entry is not None:
+            self._cache[key] = _entry
+        return _entry
+
+    def _cacheStore(self, key, entry):
+        """ Add an entry to the display cache, dropping the least recently
+            used ones beyond self.cachesize.
+        """
+        self._cache.pop(key, None)
+        self._cache[key] = entry
+        while len(self._cache) > max(self.cachesize, 0):
+            self._cache.popitem(last=False)
+
+    def _displayCached(self, _d, entry, quiet=False):
+        """ Send the scaled image and WCS kept in a display cache entry to
+            the current frame.
+        """
+        _d.setFBconfig(entry['fbconfig'])
+        _d.setFrame(self.frame)
+
+        self.z1 = entry['z1']
+        self.z2 = entry['z2']
+        if not quiet:
+            print('Image displayed with Z1: ',self.z1,' Z2:',self.z2)
+
+        _wcsinfo = entry['wcs']
+        self._sendFrame(_d, entry['bpix'], _wcsinfo, entry['digest'])
+
+        self._setViews(entry['views'],
+                       (_d.frame, _wcsinfo.name, self.z1, self.z2))
+
+    def _stretchCopy(self):
+        """ Return a NumDisplay which scales images with the current
+            settings of this one, but shares none of its buffers, caches
+            or display state.
+        """
+        _stretch = NumDisplay.__new__(NumDisplay)
+        for _attr in ('zrange', '_zclip', 'z1', 'z2', 'transform', 'scale',
+                      'offset', 'nthreads'):
+            setattr(_stretch, _attr, getattr(self, _attr))
+        _stretch._bbuf = None
+        _stretch._lut = None
+        return _stretch
+
+    def _viewSource(self, image, shape, block, binning, lut, lutdtype,
+                    transform):
+        """ Return what pan and zoom need to scale other views of an image
+            displayed with the current settings: the function returning
+            the image, its shape, the block factor and binning method it
+            was displayed with (see _binImage), the lookup table used for
+            images of type lutdtype, and whether it was transformed.
+        """
+        return {'image': image, 'shape': tuple(shape), 'block': block,
+                'binning': binning, 'lut': lut, 'lutdtype': lutdtype,
+                'transform': transform, 'stretch': self._stretchCopy()}
+
+    def _setViews(self, views, pyrview):
+        """ Make pan and zoom show the image of views, the (view source,
+            pyramids) of a displayed image, centered as it was displayed.
+        """
+        self._viewsource, self._pyramids = views
+        self._pyrview = pyrview
+        self._block = self._viewsource['block']
+        _ny,_nx = self._viewsource['shape']
+        self._center = ((_nx + 1) / 2., (_ny + 1) / 2.)
+        self._lastview = None
+
+    def release(self):
+        """ Forget the last displayed image and the tiles scaled from it,
+            so that their memory can be freed; pan and zoom are then no
+            longer possible.  (Images kept in the display cache are only
+            released with their cache entries, see display.)
+        """
+        self._viewsource = None
+        self._pyramids = {}
+        self._pyrview = None
+        self._center = None
+        self._lastview = None
+
+    def _blockOrigin(self, block, binning):
+        """ Offset (0-based, in both axes) of the image pixel which a pixel
+            of the image reduced by 'block' with 'binning' stands for.
+        """
+        if binning == 'sample':
+            return block // 2
+        return (block - 1) / 2.
+
+    def _getPyramid(self, base):
+        """ Return the pyramid of scaled tiles of the last displayed image
+            reduced by the block factor 'base', creating it if needed.
+            Each tile of its level 0 is binned from the image (see
+            _binImage) and scaled just as display() did.
+        """
+        _pyr = self._pyramids.get(base)
+        if _pyr is not None:
+            return _pyr
+
+        _src = self._viewsource
+        _stretch = _src['stretch']
+
+        def _scaletile(y0, y1, x0, x1):
+            _pix = _src['image']()
+            if base > 1:
+                _section = _stretch._binImage(_pix[y0*base:y1*base,
+                                                   x0*base:x1*base],
+                                              base, _src['binning'])
+            else:
+                _section = n.asarray(_pix[y0:y1, x0:x1])
+            _lut = _src['lut']
+            if _section.dtype != _src['lutdtype']:
+                _lut = None
+            _ny,_nx = _section.shape
+            return _stretch._fbclipImage(_section, _nx, _ny, lut=_lut,
+                                         transform=_src['transform'])
+
+        _ny,_nx = _src['shape']
+        _pyr = pyramid.ImagePyramid((_ny // base, _nx // base), _scaletile)
+        self._pyramids[base] = _pyr
+        return _pyr
+
+    def _viewLevel(self, block):
+        """ Return the (pyramid, level, block origin) which give the last
+            displayed image reduced by 'block': the pyramid based on the
+            block factor it was displayed with, for power of 2 multiples
+            of that factor, or else the full resolution one.
+        """
+        _src = self._viewsource
+        for _base in (_src['block'], 1):
+            _ratio = block // _base
+            if block % _base or _ratio & (_ratio - 1):
+                continue
+            _level = _ratio.bit_length() - 1
+            _pyr = self._getPyramid(_base)
+            if _level >= _pyr.nlevels:
+                continue
+            _origin = self._blockOrigin(_base, _src['binning'])
+            if _level > 0:
+                _origin += ((1 << _level) - 1) / 2. * _base
+            return _pyr, _level, _origin
+        raise ValueError("Cannot display the image reduced by %d" % block)
+
+    def pan(self, x, y):
+        """ Redisplay the last displayed image centered on its pixel (x, y),
+            with the current block factor (the one it was displayed with,
+            see display(fit='bin'), or the one set by zoom).
+        """
+        self._showView(self._block, x, y)
+
+    def zoom(self, level, x=None, y=None):
+        """ Redisplay the last displayed image reduced by a factor 2**level
+            (level 0 being full resolution), centered on its pixel (x, y),
+            or by default on the center of the current view.
+
+            Levels above 0 are averaged from the scaled pixels of level 0
+            (see the pyramid module): with a nonlinear transform, they do
+            not quite match the image binned before scaling, as shown by
+            display(fit='bin') and by pan after it.
+        """
+        if self._viewsource is None:
+            raise ValueError("No image has been displayed yet")
+        _nlevels = self._getPyramid(1).nlevels
+        if level < 0 or level >= _nlevels:
+            raise ValueError("Zoom level must be between 0 and %d" %
+                             (_nlevels - 1))
+        if x is None:
+            x = self._center[0]
+        if y is None:
+            y = self._center[1]
+        self._showView(1 << level, x, y)
+
+    def _showView(self, block, x, y):
+        """ Send the frame buffer sized view of the image reduced by the
+            factor 'block' centered on image pixel (x, y).  Only the tiles
+            which were never shown before are scaled, and nothing is sent
+            if the view has not changed.
+        """
+        if self._viewsource is None:
+            raise ValueError("No image has been displayed yet")
+        _pyr, _level, _s = self._viewLevel(block)
+        _frame, _name, _z1, _z2 = self._pyrview
+        _d = self.view._display
+
+        # Pixel of the view (0-based) closest to image pixel (x, y)
+        _cx = int(round((x - 1 - _s) / block))
+        _cy = int(round((y - 1 - _s) / block))
+        _x0 = _cx - _d.fbwidth // 2
+        _y0 = _cy - _d.fbheight // 2
+        self._block = block
+        self._center = (x, y)
+        if self._lastview == (block, _x0, _y0) and _d.frame == _frame:
+            return
+
+        _view = _pyr.region(_level, _y0, _x0,
+                            _y0 + _d.fbheight, _x0 + _d.fbwidth)
+        _wcsinfo = displaydev.ImageWCS(_view, z1=_z1, z2=_z2, name=_name)
+        _wcsinfo.block = block
+        _wcsinfo.blockorigin = _s
+        _wcsinfo.x0 = _x0
+        _wcsinfo.y0 = _y0
+
+        _d.setFrame(_frame)
+        _d.syncWCS(_wcsinfo)
+        self._sendFrame(_d, _view, _wcsinfo)
+        self._lastview = (block, _x0, _y0)
+
+    def _sendFrame(self, _d, bpix, wcsinfo, digest=None):
+        """ Send the byte-scaled image bpix and its (synced) WCS to the
+            active frame of the display _d, unless the frame already holds
+            them.  The frame is only erased when bpix does not cover all
+            of it, and it does not just hold an image of the same size and
+            position (then writeImage only sends the rows which changed,
+            if the display keeps a shadow of the frame).
+            What is known of the frame is first confirmed with the display,
+            in case another client changed it.
+            Returns the digest of bpix (see displaydev.imageDigest).
+        """
+        if digest is None:
+            digest = displaydev.imageDigest(bpix, wcsinfo)
+        _d.checkResident()
+        if _d.isResident(wcsinfo, digest):
+            return digest
+        if (bpix.shape != (_d.fbheight, _d.fbwidth) and
+                not _d.samePlacement(digest)):
+            _d.eraseFrame()
+        _d.writeWCS(wcsinfo)
+        _d.writeImage(bpix, wcsinfo, digest=digest)
+        return digest
+
     def readcursor(self,sample=0):
         """ Return the cursor position from the image display. """
         return self.view.readCursor(sample=sample)
@@ -493,6 +1082,9 @@ close = view.close
 
 set = view.set
 display = view.display
+pan = view.pan
+zoom = view.zoom
+release = view.release
 readcursor = view.readcursor
 getHandle = view.getHandle
 checkDisplay = view.checkDisplay
@@ -0,0 +1,23 @@
+"""benchmarks: Display throughput benchmarks for numdisplay
+
+    The benchmarks time NumDisplay.display against the in-process IIS
+    server (see iisserver) over a matrix of image sizes, data types and
+    transports, so that the speed of the whole display path can be
+    tracked from one release to the next.
+
+        run(sizes=None, dtypes=None, transports=None, repeat=3, output=None)::
+            Run the benchmark matrix and return the list of results,
+            optionally writing them as JSON to the file 'output'.
+
+        compare(baseline, results, tolerance=0.1)::
+            Report the cases which became slower than a previous run.
+
+    The benchmarks can also be run from the command line::
+
+        python -m stsci.numdisplay.benchmarks --sizes 512,2048 -o run.json
+        python -m stsci.numdisplay.benchmarks --compare old.json -o new.json
+
+"""
+from __future__ import absolute_import, division, print_function # confidence high
+
+from .throughput import *
@@ -0,0 +1,7 @@
+from __future__ import absolute_import # confidence high
+
+import sys
+
+from .throughput import main
+
+sys.exit(main())
@@ -0,0 +1,292 @@
+"""throughput.py: Time NumDisplay.display end to end
+
+Each benchmark case displays one synthetic image of a given size and data
+type through a given transport to an in-process IIS server, and records:
+
+    seconds     median wall time of one display call, including a final
+                round trip so that the server has consumed every packet
+    mbps        input image megabytes displayed per second
+    wire_mbps   megabytes sent to the server per second
+    fps         display calls per second
+    packets     IIS packets per display call, by subunit
+    stages      median time spent in each stage of the display path
+
+The results are plain dictionaries, written as a JSON list by run(), so
+that two runs can be compared with compare().
+"""
+from __future__ import absolute_import, division, print_function # confidence high
+
+import json, os, platform, shutil, tempfile, time
+
+import numpy as n
+import stsci.numdisplay as numdisplay
+from .. import iisserver
+
+__all__ = ['run', 'compare', 'main', 'SIZES', 'DTYPES', 'TRANSPORTS']
+
+SIZES = (512, 1024, 2048, 4096, 8192)
+# '>i2' and '>f4' are the big-endian layouts of FITS BITPIX 16 and -32 data
+DTYPES = ('uint16', 'int32', 'float32', 'float64', '>i2', '>f4')
+TRANSPORTS = ('unix', 'inet', 'fifo')
+
+# Methods of NumDisplay and of the ImageDisplay in use which are timed
+# as separate stages, where they exist.
+_DISPLAY_STAGES = ('_lookupTable', '_fbclipImage')
+_DEVICE_STAGES = ('selectFB', 'eraseFrame', 'writeWCS', 'writeImage')
+
+try:
+    _clock = time.perf_counter
+except AttributeError:
+    _clock = time.time
+
+
+class _StageTimer(object):
+
+    """ Accumulates the time spent in wrapped methods."""
+
+    def __init__(self):
+        self.times = {}
+        # (obj, name, attribute of the instance itself or None) of the
+        # wrapped methods, to restore them
+        self._wrapped = []
+
+    def wrap(self, obj, name):
+        func = getattr(obj, name, None)
+        if func is None:
+            return
+        self._wrapped.append((obj, name, vars(obj).get(name)))
+        times = self.times
+        times[name] = 0.
+
+        def timed(*args, **kwargs):
+            t0 = _clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                times[name] += _clock() - t0
+        setattr(obj, name, timed)
+
+    def reset(self):
+        for name in self.times:
+            self.times[name] = 0.
+
+    def restore(self):
+        """ Put back the methods replaced by wrap."""
+        while self._wrapped:
+            obj, name, attr = self._wrapped.pop()
+            if attr is None:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, attr)
+
+
+def _makeImage(size, dtype, seed=0):
+    """ Synthetic sky: a gradient plus noise, cast to dtype."""
+    rng = n.random.RandomState(seed)
+    y, x = n.mgrid[0:size, 0:size]
+    image = 100. + 0.01 * (x + y) + rng.normal(0., 10., (size, size))
+    dtype = n.dtype(dtype)
+    if dtype.kind in 'ui':
+        image = n.clip(image, n.iinfo(dtype).min, n.iinfo(dtype).max)
+    return image.astype(dtype)
+
+def _imtdev(transport, tmpdir):
+    if transport == 'unix':
+        return 'unix:' + os.path.join(tmpdir, '.IMT%d')
+    elif transport == 'inet':
+        return 'inet:0'
+    elif transport == 'fifo':
+        return 'fifo:%s:%s' % (os.path.join(tmpdir, 'imt1i'),
+                               os.path.join(tmpdir, 'imt1o'))
+    raise ValueError("Unknown transport `%s'" % transport)
+
+def _median(values):
+    return float(n.median(values))
+
+def _case(disp, server, image, repeat):
+    """ Time 'repeat' displays of image; returns the result dictionary."""
+    _d = disp.view._display
+    timer = _StageTimer()
+    try:
+        for name in _DISPLAY_STAGES:
+            timer.wrap(disp, name)
+        for name in _DEVICE_STAGES:
+            timer.wrap(_d, name)
+
+        # One untimed display warms up the buffers and the connection.
+        # Displays use the default settings (no display cache), and the
+        # frame residency is reset before each one, so that every display
+        # goes through the whole display path.
+        disp.display(image, quiet=True)
+        _d.readInfo()
+
+        seconds = []
+        stages = dict((name, []) for name in timer.times)
+        packets = []
+        nbytes = []
+        for i in range(repeat):
+            server.reset()
+            _d.invalidate()
+            timer.reset()
+            t0 = _clock()
+            disp.display(image, quiet=True)
+            # Wait for the server to consume everything that was sent
+            _d.readInfo()
+            seconds.append(_clock() - t0)
+            for name in stages:
+                stages[name].append(timer.times[name])
+            packets.append(dict(server.packets))
+            nbytes.append(server.nbytes)
+    finally:
+        # Leave the display objects as they were
+        timer.restore()
+
+    t = _median(seconds)
+    return {'seconds': t,
+            'mbps': image.nbytes / t / 1.e6,
+            'wire_mbps': _median(nbytes) / t / 1.e6,
+            'fps': 1. / t,
+            'packets': packets[-1],
+            'stages': dict((name, _median(v)) for name, v in stages.items())}
+
+def run(sizes=None, dtypes=None, transports=None, repeat=3, output=None,
+        quiet=False):
+    """ Run the benchmark matrix.
+
+    Parameters
+    ----------
+    sizes : list of int
+        edge lengths of the square test images (default: SIZES)
+    dtypes : list of str
+        numpy data types of the test images (default: DTYPES)
+    transports : list of str
+        any of 'unix', 'inet' and 'fifo' (default: TRANSPORTS)
+    repeat : int
+        number of timed displays per case; the median is reported
+    output : str
+        name of a file to which the results are written as JSON
+    quiet : bool
+        if True, do not print the results table
+
+    Returns
+    -------
+    list of dictionaries, one per case
+    """
+
+    sizes = sizes or SIZES
+    dtypes = dtypes or DTYPES
+    transports = transports or TRANSPORTS
+
+    env = {'python': platform.python_version(), 'numpy': n.__version__,
+           'platform': platform.platform(),
+           'numdisplay': getattr(numdisplay, '__version__', None),
+           'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+    results = []
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for transport in transports:
+            server = iisserver.IISServer(_imtdev(transport, tmpdir)).start()
+            disp = numdisplay.NumDisplay()
+            try:
+                disp.open(server.imtdev)
+                for size in sizes:
+                    for dtype in dtypes:
+                        image = _makeImage(size, dtype)
+                        result = _case(disp, server, image, repeat)
+                        result.update({'transport': transport, 'size': size,
+                                       'dtype': n.dtype(dtype).str,
+                                       'env': env})
+                        results.append(result)
+                        if not quiet:
+                            _report(result)
+                        del image
+            finally:
+                disp.close()
+                server.stop()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if output:
+        f = open(output, 'w')
+        json.dump(results, f, indent=1, sort_keys=True)
+        f.close()
+    return results
+
+def _key(result):
+    return (result['transport'], result['size'], result['dtype'])
+
+def _report(result):
+    print("%-5s %5d %-4s %8.4f s %8.1f MB/s %8.1f MB/s(wire) %7.2f fr/s "
+          "%6d pkts" % (result['transport'], result['size'], result['dtype'],
+                        result['seconds'], result['mbps'],
+                        result['wire_mbps'], result['fps'],
+                        sum(result['packets'].values())))
+    stages = sorted(result['stages'].items())
+    print("      " + "  ".join(["%s %.4f" % s for s in stages]))
+
+def compare(baseline, results, tolerance=0.1, quiet=False):
+    """ Compare results with a baseline run (lists of result dictionaries,
+    or names of JSON files written by run).
+
+    Returns the list of (transport, size, dtype, ratio) of the cases that
+    are slower than the baseline by more than 'tolerance' (a fraction).
+    """
+
+    if not isinstance(baseline, list):
+        f = open(baseline)
+        baseline = json.load(f)
+        f.close()
+    if not isinstance(results, list):
+        f = open(results)
+        results = json.load(f)
+        f.close()
+
+    old = dict((_key(r), r) for r in baseline)
+    slower = []
+    for r in results:
+        if _key(r) not in old:
+            continue
+        ratio = r['seconds'] / old[_key(r)]['seconds']
+        if not quiet:
+            print("%-5s %5d %-4s %6.2fx" % (_key(r) + (ratio,)))
+        if ratio > 1. + tolerance:
+            slower.append(_key(r) + (ratio,))
+    return slower
+
+def main(args=None):
+    """ Command line interface; returns 1 if a comparison found
+    regressions, 0 otherwise."""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+                prog='python -m stsci.numdisplay.benchmarks',
+                description='Time numdisplay.display against a local IIS server')
+    parser.add_argument('--sizes', default=None,
+                        help='comma separated image sizes (default: %s)' %
+                             ','.join([str(s) for s in SIZES]))
+    parser.add_argument('--dtypes', default=None,
+                        help='comma separated data types (default: %s)' %
+                             ','.join(DTYPES))
+    parser.add_argument('--transports', default=None,
+                        help='comma separated transports (default: %s)' %
+                             ','.join(TRANSPORTS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-o', '--output', default=None,
+                        help='write the results as JSON to this file')
+    parser.add_argument('--compare', default=None,
+                        help='JSON results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    opts = parser.parse_args(args)
+
+    split = lambda s: s and s.split(',') or None
+    sizes = opts.sizes and [int(s) for s in opts.sizes.split(',')]
+    results = run(sizes, split(opts.dtypes), split(opts.transports),
+                  repeat=opts.repeat, output=opts.output)
+    if opts.compare:
+        slower = compare(opts.compare, results, opts.tolerance)
+        if slower:
+            print("%d case(s) slower than the baseline" % len(slower))
+            return 1
+    return 0
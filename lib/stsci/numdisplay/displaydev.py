@@ -31,10 +31,11 @@ $Id$
 """
 from __future__ import division, print_function # confidence medium
 
-import os, socket, struct
+import os, socket, struct, zlib
 
 import numpy as n
 from . import imconfig
+from . import tiles
 
 try:
     # Only try to import this on Unix-compatible systems,
@@ -62,10 +63,56 @@ except AttributeError as error:
     SOCKTYPE = socket.AF_INET
 
 SZ_BLOCK = 16384
+# The byte count of a _MEMORY packet travels as a negative 16-bit value,
+# so no single packet may carry more than this many pixels.
+SZ_MAXBLOCK = 32768
+
+# Largest number of buffers handed to a single sendmsg/writev call
+try:
+    _IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 1024
+if _IOV_MAX <= 0:
+    _IOV_MAX = 1024
+
+# IIS packet header: tid, thingct, subunit, checksum, x, y, z, t
+_IIS_HEADER = struct.Struct('8H')
+
+# Number of read requests sent ahead by readRegion before reading the
+# replies; their headers (16 bytes each) easily fit in any pipe buffer.
+_READ_BATCH = 64
 
 _default_imtdev = ("unix:/tmp/.IMT%d", "fifo:/dev/imt1i:/dev/imt1o","inet:5137")
 _default_fbconfig = 3
 
+# Relative precision to which the WCS values read back from a frame must
+# match those written to it: ds9 and ximtool write them back with %g.
+_WCS_RTOL = 1e-5
+
+def _sameWCS(wcs1, wcs2, rtol=_WCS_RTOL):
+    """ Return True if the WCS strings wcs1 and wcs2 have the same name and
+    the same values, numbers being compared to a relative precision rtol
+    (display servers may write them back in another format)."""
+
+    _name1, _sep, _values1 = wcs1.partition('\n')
+    _name2, _sep, _values2 = wcs2.partition('\n')
+    _values1 = _values1.split()
+    _values2 = _values2.split()
+    if _name1.strip() != _name2.strip() or len(_values1) != len(_values2):
+        return False
+    for _v1,_v2 in zip(_values1, _values2):
+        try:
+            _f1 = float(_v1)
+            _f2 = float(_v2)
+        except ValueError:
+            if _v1 != _v2:
+                return False
+            continue
+        if abs(_f1 - _f2) > rtol * max(abs(_f1), abs(_f2)):
+            return False
+    return True
+
+
 class ImageWCS(object):
     _W_UNITARY = 0
     _W_LINEAR = 1
@@ -84,14 +131,16 @@ class ImageWCS(object):
         self.dtx = _shape[1] / 2.
         self.dty = _shape[0] / 2.
 
-        # Determine full range of pixel values for image
-        if not z1:
-            self.z1 = n.minimum.reduce(n.ravel(pix))
+        # Determine full range of pixel values for image, unless given
+        if z1 is None or z2 is None:
+            _zmin,_zmax = tiles.minmax(pix)
+        if z1 is None:
+            self.z1 = _zmin
         else:
             self.z1 = z1
 
-        if not z2:
-            self.z2 = n.maximum.reduce(n.ravel(pix))
+        if z2 is None:
+            self.z2 = _zmax
         else:
             self.z2 = z2
 
@@ -106,6 +155,16 @@ class ImageWCS(object):
         self.ny,self.nx = pix.shape
         self.full_ny, self.full_nx = pix.shape
 
+        # pix may be the original image reduced by an integer factor
+        # 'block', each of its pixels standing for the image pixel at
+        # (0-based) offset 'blockorigin' in both axes of its block.
+        self.block = 1
+        self.blockorigin = 0.
+        # pix may also be a section of that image, starting at (0-based)
+        # column x0 and row y0
+        self.x0 = 0
+        self.y0 = 0
+
     def update(self,wcsstr):
         # This routine will accept output from readWCS and
         # update the WCS attributes with the values
@@ -240,6 +299,11 @@ class ImageDisplay(object):
     _SZ_IMCURVAL = 160
     _SZ_WCSBUF = 320
 
+    # Keep a shadow of each frame (see _resident), which costs one byte per
+    # frame buffer pixel for every frame used; set to True here for all
+    # displays, or on one display, to send only the rows which changed.
+    shadowframes = False
+
     def __init__(self):
         # Flag indicating that readCursor request is active.
         # This is used to handle interruption of readCursor before
@@ -260,6 +324,19 @@ class ImageDisplay(object):
         self.fbwidth = self.fbdict[self.fbconfig]['width']
         self.fbheight = self.fbdict[self.fbconfig]['height']
 
+        # Maximum number of bytes sent in each _MEMORY packet by writeImage
+        self.blocksize = SZ_BLOCK
+
+        # What each frame is known to hold: {frame: [fbconfig, WCS string,
+        # image digest, shadow]}, None standing for unknown.  The shadow is
+        # a uint8 copy of the whole frame buffer (in frame buffer order,
+        # top row first), kept once all of it is known, if shadowframes is
+        # set; writeImage then only sends the rows which changed.  Only
+        # what is sent through this object is tracked: checkResident (and
+        # any WCS read) drops the record of a frame whose WCS was changed
+        # by another client, and invalidate() drops it unconditionally.
+        self._resident = {}
+
 
     def getDefaultFBConfig(self):
         try:
@@ -296,7 +373,7 @@ class ImageDisplay(object):
                 opcode |= self._IMC_SAMPLE
             self._writeHeader(opcode, self._IMCURSOR, 0, 0, 0, 0, 0)
             self._inCursorMode = 1
-        s = self._read(self._SZ_IMCURVAL)
+        s = _decode(self._read(self._SZ_IMCURVAL))
         self._inCursorMode = 0
         # only part up to newline is real data
         return s.split("\n")[0]
@@ -377,9 +454,21 @@ class ImageDisplay(object):
         opcode = self._IIS_WRITE | self._PACKED
         frame = 1 << (self.frame-1)
         nbytes = pix.size * pix.itemsize
-        self._writeHeader(opcode,self._MEMORY, -nbytes, x, y, frame, 0)
+        _hdr = _encodeHeader(opcode,self._MEMORY, -nbytes, x, y, frame, 0)
+        # The frame no longer holds a known image, but its shadow can follow
+        _rec = self._residency()
+        _rec[2] = None
+        if _rec[3] is not None:
+            _start = y * self.fbwidth + x
+            _flat = _rec[3].reshape(-1)
+            if 0 <= _start and _start + nbytes <= _flat.size:
+                _flat[_start:_start + nbytes] = \
+                    n.ascontiguousarray(pix).reshape(-1).view(n.uint8)
+            else:
+                _rec[3] = None
 
-        status = self._write(pix.tostring())
+        # Send the header and the pixels straight from the array buffer
+        status = self._writev([_hdr] + _rowbuffers(pix))
         return status
 
     def readData(self,x,y,pix):
@@ -394,6 +483,74 @@ class ImageDisplay(object):
         # Get the pixels now
         return self._read(nbytes)
 
+    def readRegion(self,x0,y0,nx,ny,blocksize=None):
+
+        """ Read the nx x ny pixels of the active frame starting at column
+        x0 and row y0, both counted (from 0) from the lower left corner of
+        the frame buffer.
+
+        Returns a uint8 array in image orientation (row 0 at the bottom),
+        as a flipped view of the array which the pixels are read into.
+        Regions spanning the width of the frame buffer are read as many
+        rows at a time as fit in 'blocksize' bytes (default:
+        self.blocksize); narrower regions are read one row (segment) per
+        request.  Several requests are sent before reading the replies.
+        """
+
+        _fbw = self.fbwidth
+        _fbh = self.fbheight
+        if (nx <= 0 or ny <= 0 or x0 < 0 or y0 < 0 or
+                x0 + nx > _fbw or y0 + ny > _fbh):
+            raise ValueError("Region outside of the frame buffer")
+        if blocksize is None:
+            blocksize = self.blocksize
+        blocksize = max(1, min(blocksize, SZ_MAXBLOCK))
+
+        # The pixels are read in frame buffer order, top row first
+        _fbuf = n.empty((ny, nx), dtype=n.uint8)
+        _top = _fbh - (y0 + ny)
+
+        _blocks = []
+        _xs = []
+        _ys = []
+        if nx == _fbw:
+            _lper_block = max(1, blocksize // _fbw)
+            for _r0 in range(0, ny, _lper_block):
+                _blocks.append(_fbuf[_r0:_r0 + _lper_block])
+                _xs.append(0)
+                _ys.append(_top + _r0)
+        else:
+            _xper_block = min(nx, blocksize)
+            for _r in range(ny):
+                for _c0 in range(0, nx, _xper_block):
+                    _blocks.append(_fbuf[_r, _c0:_c0 + _xper_block])
+                    _xs.append(x0 + _c0)
+                    _ys.append(_top + _r)
+
+        opcode = self._IIS_READ | self._PACKED
+        frame = 1 << (self.frame-1)
+        for _b0 in range(0, len(_blocks), _READ_BATCH):
+            _batch = _blocks[_b0:_b0 + _READ_BATCH]
+            _hdrs = _encodeHeaders(opcode, self._MEMORY,
+                                   [-_block.nbytes for _block in _batch],
+                                   _xs[_b0:_b0 + _READ_BATCH],
+                                   _ys[_b0:_b0 + _READ_BATCH], frame, 0)
+            self._writev(list(_hdrs))
+            for _block in _batch:
+                self._readinto(_block)
+
+        # Reading the whole frame makes its contents known
+        if nx == _fbw and ny == _fbh and self.shadowframes:
+            self._residency()[3] = n.array(_fbuf)
+        return _fbuf[::-1]
+
+    def readFrame(self):
+
+        """ Read the whole active frame; returns a uint8 array of shape
+        (fbheight, fbwidth) in image orientation (see readRegion)."""
+
+        return self.readRegion(0, 0, self.fbwidth, self.fbheight)
+
     def setCursor(self,x,y,wcs):
 
         """ Moves cursor to specified position in frame. """
@@ -424,12 +581,117 @@ class ImageDisplay(object):
 
         frame = 1 << (self.frame-1)
         self._writeHeader(opcode, self._FEEDBACK, 0,0,0,frame,0)
+        # The display may drop the WCS of an erased frame as well
+        _rec = self._residency()
+        _rec[1] = _rec[2] = None
+        if not self.shadowframes:
+            _rec[3] = None
+        elif _rec[3] is not None:
+            _rec[3][...] = 0
+        else:
+            _rec[3] = n.zeros((self.fbheight, self.fbwidth), dtype=n.uint8)
+
+    def _residency(self):
+        """ Return the residency record of the active frame, which is reset
+        if it was made with another frame buffer configuration."""
+
+        _rec = self._resident.get(self.frame)
+        if _rec is None or _rec[0] != self.fbconfig:
+            _rec = self._resident[self.frame] = [self.fbconfig, None, None,
+                                                 None]
+        return _rec
+
+    def samePlacement(self,digest):
+        """ Return True if the active frame holds an image with the same
+        shape and position as the image with the given digest, and nothing
+        else, so that only pixels of that image may differ."""
+
+        _rec = self._resident.get(self.frame)
+        return (_rec is not None and _rec[0] == self.fbconfig and
+                _rec[2] is not None and digest is not None and
+                _rec[2][:-1] == digest[:-1])
+
+    def isResident(self,wcsinfo,digest):
+        """ Return True if the active frame already holds the image with the
+        given digest (see imageDigest) and the WCS wcsinfo, as last sent by
+        writeWCS and writeImage with the current frame buffer configuration.
+        """
+        _rec = self._resident.get(self.frame)
+        return (_rec is not None and _rec[0] == self.fbconfig and
+                _rec[1] == str(wcsinfo) and digest is not None and
+                _rec[2] == digest)
+
+    def shadowValue(self,x,y):
+        """ Return the value of pixel (x, y) of the active frame (frame
+        buffer coordinates, as for readData) as known from its shadow, or
+        None if it is not known, in which case readData has to be used."""
+
+        _rec = self._resident.get(self.frame)
+        if _rec is None or _rec[0] != self.fbconfig or _rec[3] is None:
+            return None
+        _index = y * self.fbwidth + x
+        if 0 <= _index < _rec[3].size:
+            return int(_rec[3].flat[_index])
+        return None
+
+    def checkResident(self):
+        """ Confirm, with one WCS round trip, that the active frame still
+        holds what was last sent to it through this object, and forget what
+        is known of it otherwise (for instance when another client loaded
+        an image into it).  Returns True if its contents are known."""
+
+        _rec = self._resident.get(self.frame)
+        if _rec is None or _rec[0] != self.fbconfig:
+            return False
+        if _rec[1] is None:
+            # Contents without a known WCS cannot be confirmed
+            self.invalidate(self.frame)
+            return False
+        frame = 1 << (self.frame-1)
+        self._writeHeader(self._IIS_READ, self._WCS, 0,0,0,frame,0)
+        return self._checkWCS(_decode(self._read(self._SZ_WCSBUF)))
+
+    def _checkWCS(self,wcsstr):
+        """ Forget what is known of the active frame if the WCS wcsstr read
+        from the display is not the one last written to it."""
+
+        _rec = self._resident.get(self.frame)
+        if _rec is None or _rec[1] is None:
+            return False
+        if not _sameWCS(wcsstr, _rec[1]):
+            self.invalidate(self.frame)
+            return False
+        return True
+
+    def invalidate(self,frame=None):
+        """ Forget what is known of the contents of a frame (by default, of
+        all frames), for instance after they were changed by other clients,
+        so that the next writeWCS and writeImage send everything again.
+
+        Changes by other clients are only noticed (by checkResident) when
+        they change the WCS of the frame: a client which writes other
+        pixels with the same WCS (such as another numdisplay process
+        showing an image of the same name, size and range) leaves isResident
+        true, and the next display of the same image is then skipped,
+        unless the frame is invalidated first."""
+
+        if frame is None:
+            self._resident.clear()
+        else:
+            self._resident.pop(frame, None)
 
     def writeWCS(self,wcsinfo):
 
         """ Writes out WCS information for frame to display device."""
 
-        _str = str(wcsinfo).rstrip()
+        # Nothing to do if the frame already has this WCS
+        _rec = self._residency()
+        _wcsstr = str(wcsinfo)
+        if _rec[1] == _wcsstr:
+            return
+        _rec[1] = None
+
+        _str = _wcsstr.rstrip().encode('ascii', 'replace')
         nbytes = len(_str)
         opcode = self._IIS_WRITE | self._PACKED
         frame = 1 << (self.frame-1)
@@ -438,6 +700,7 @@ class ImageDisplay(object):
         self._writeHeader(opcode,self._WCS, -nbytes, 0,0, frame, fbconfig)
 
         status = self._write(_str)
+        _rec[1] = _wcsstr
 
     def readWCS(self,wcsinfo):
 
@@ -447,7 +710,9 @@ class ImageDisplay(object):
 
         self._writeHeader(self._IIS_READ, self._WCS, 0,0,0,frame,0)
 
-        wcsinfo.update(self._read(self._SZ_WCSBUF))
+        wcsstr = _decode(self._read(self._SZ_WCSBUF))
+        self._checkWCS(wcsstr)
+        wcsinfo.update(wcsstr)
         return wcsinfo
 
     def readInfo(self):
@@ -457,7 +722,8 @@ class ImageDisplay(object):
 
         self._writeHeader(self._IIS_READ, self._WCS, 0,0,0,frame,0)
 
-        wcsstr = self._read(self._SZ_WCSBUF)
+        wcsstr = _decode(self._read(self._SZ_WCSBUF))
+        self._checkWCS(wcsstr)
         _wcs = wcsstr.split()
         tx = int(round(float(_wcs[5])))
         ty = int(round(float(_wcs[6])))
@@ -481,16 +747,54 @@ class ImageDisplay(object):
         wcsinfo.dtx = int((wcsinfo.nx / 2.) - ((self.fbwidth) / 2.) + 0.5)
         wcsinfo.dty = int((self.fbheight) + ((wcsinfo.ny / 2.) - (self.fbheight / 2.)) + 0.5)
 
-    def writeImage(self,pix,wcsinfo):
+        # For a section of a (block reduced) image, shift the origin, and
+        # scale the transformation so that frame buffer positions map onto
+        # pixels of the original image.
+        wcsinfo.tx += wcsinfo.x0
+        wcsinfo.ty += wcsinfo.y0
+        _f = wcsinfo.block
+        if _f != 1:
+            _shift = wcsinfo.blockorigin - (_f - 1)
+            wcsinfo.a = float(_f)
+            wcsinfo.d = -float(_f)
+            wcsinfo.tx = _f * wcsinfo.tx + _shift
+            wcsinfo.ty = _f * wcsinfo.ty + _shift
+
+    def writeImage(self,pix,wcsinfo,blocksize=None,digest=None):
+
+        """ Write out image to display device in blocks of up to 'blocksize'
+        bytes (default: self.blocksize, at most SZ_MAXBLOCK).
+
+        Nothing is sent if the frame is known to hold this image already,
+        as identified by its digest (computed by imageDigest unless given).
+
+        When the image spans the full width of the frame buffer, as many
+        whole rows as fit in a block are packed into each _MEMORY packet,
+        since consecutive rows are contiguous in the frame buffer.  Narrower
+        images are sent one row per packet, and rows wider than a block are
+        split into segments.
+
+        If the contents of the frame are known (it was erased or fully
+        written through this object, see shadowframes), only the runs of
+        rows which differ from them are sent.
+        """
+
+        if blocksize is None:
+            blocksize = self.blocksize
+        blocksize = max(1, min(blocksize, SZ_MAXBLOCK))
 
-        """ Write out image to display device in 32Kb sections."""
+        if digest is None:
+            digest = imageDigest(pix, wcsinfo)
+        _rec = self._residency()
+        if _rec[2] == digest:
+            return
+        _rec[2] = None
 
         _fbnum = self.fbconfig
         _fbw = self.fbdict[_fbnum]['width']
         _fbh = self.fbdict[_fbnum]['height']
         _nx,_ny = wcsinfo.nx,wcsinfo.ny
         _ty = wcsinfo.dty
-        _tx = wcsinfo.dtx
 
         _nnx = min(_nx,_fbw)
         _nny = min(_ny,_fbh)
@@ -498,62 +802,96 @@ class ImageDisplay(object):
         # compute the range in output pixels the input image would cover
         # input image could be smaller than buffer size/output image size.
         _lx = (_fbw // 2) - (_nnx // 2)
+        # frame buffer line which receives the top line of the image
+        _ly = _fbh - _ty
+
+        if _nnx == _fbw:
+            _lper_block = max(1, blocksize // _fbw)
+        else:
+            _lper_block = 1
+        _xper_block = min(_nnx, blocksize)
 
-        _lper_block = SZ_BLOCK // _fbw
-        if _lper_block > 1: _lper_block = 1
-        _nblocks = _nny // _lper_block
+        opcode = self._IIS_WRITE | self._PACKED
+        frame = 1 << (self.frame-1)
 
         # Flip image array so that (0,0) pixel is in upper left
         _fpix = pix[::-1,:]
 
-        # Now, for each block, write out the image section
-        if _lper_block == 1:
-            # send each line of image to display
-            for block in range(int(_nblocks)):
-                _ydisp = _fbh - (_ty - block)
-                self.writeData(_lx,_ydisp,_fpix[block,:])
+        # Runs of rows [start, end) to send: those which differ from the
+        # shadow of the frame, when there is one.
+        _shadow = _rec[3]
+        if _shadow is not None:
+            _old = _shadow[_ly:_ly + _nny, _lx:_lx + _nnx]
+            _changed = n.not_equal(_old, _fpix[:_nny,:_nnx]).any(axis=1)
+            _runs = _rowruns(_changed)
         else:
-            # display each line segment separately
-            for block in range(int(_nblocks)):
-                _y0 = block * _lper_block
-                _ydisp = _fbh - (_ty - _y0)
-                _xper_block = (_nx // (_nx * _lper_block))
-                for xblock in range(int(_xper_block)):
-                    _x0 = xblock * _xper_block
-                    _xend = xblock + 1 * _xper_block
-                    if _xend > _nx: _xend = _nx
-                    self.writeData(_lx,_ydisp,_fpix[_y0,_x0:_xend])
-
-        #Now pick up last impartial block
-        _yend = int(_nblocks) * _lper_block
-        if _yend < _ny:
-            #self.writeData(_lx,_yend+_ty,_fpix[_yend:0,:])
-            self.writeData(_lx,_yend+_ty,_fpix[:_yend,:])
+            _runs = [(0, _nny)]
+
+        # Now, for each block, pick out the image section and its position
+        # in the frame buffer; the last block of a run picks up any rows
+        # left over when its length is not a multiple of _lper_block.
+        _blocks = []
+        _xs = []
+        _ys = []
+        for _r0,_r1 in _runs:
+            for _y0 in range(_r0, _r1, _lper_block):
+                if _lper_block > 1:
+                    _y1 = min(_y0 + _lper_block, _r1)
+                    _blocks.append(_fpix[_y0:_y1,:])
+                    _xs.append(_lx)
+                    _ys.append(_ly + _y0)
+                else:
+                    # display each line segment separately
+                    for _x0 in range(0, _nnx, _xper_block):
+                        _x1 = min(_x0 + _xper_block, _nnx)
+                        _blocks.append(_fpix[_y0,_x0:_x1])
+                        _xs.append(_lx + _x0)
+                        _ys.append(_ly + _y0)
+
+        # Encode all of the headers at once, then send each header followed
+        # by its rows in as few gathering writes as possible.
+        if _blocks:
+            _nbytes = [-_block.nbytes for _block in _blocks]
+            _hdrs = _encodeHeaders(opcode, self._MEMORY, _nbytes, _xs, _ys,
+                                   frame, 0)
+            _iov = []
+            for _hdr,_block in zip(_hdrs,_blocks):
+                _iov.append(_hdr)
+                _iov.extend(_rowbuffers(_block))
+            self._writev(_iov)
+        _rec[2] = digest
+
+        # Bring the shadow up to date; an image which covers the whole frame
+        # makes all of it known.
+        if _shadow is not None:
+            for _r0,_r1 in _runs:
+                _old[_r0:_r1] = _fpix[_r0:_r1,:_nnx]
+        elif (self.shadowframes and _nnx == _fbw and _nny == _fbh and
+              _lx == 0 and _ly == 0):
+            _rec[3] = n.array(_fpix[:_nny,:_nnx], dtype=n.uint8)
 
 
     def _writeHeader(self,tid,subunit,thingct,x,y,z,t):
 
         """Write request to image display"""
 
-        a = n.array([tid,thingct,subunit,0,x,y,z,t],dtype=n.uint16)
-        # Compute the checksum
-        sum = n.add.reduce(a,dtype=n.uint16)
-        sum = 0xffff - (sum & 0xffff)
-        a[3] = sum
-        self._write(a.tostring())
+        self._write(_encodeHeader(tid,subunit,thingct,x,y,z,t))
 
     def close(self, os_close=os.close):
 
         """Close image display connection"""
 
+        # Forget the descriptors once closed: __del__ closes again, and by
+        # then the numbers may belong to a newer display connection.
         try:
             os_close(self._fdin)
-        except (OSError, AttributeError):
+        except (OSError, AttributeError, TypeError):
             pass
         try:
             os_close(self._fdout)
-        except (OSError, AttributeError):
+        except (OSError, AttributeError, TypeError):
             pass
+        self._fdin = self._fdout = None
 
     def getHandle(self):
         return self
@@ -570,20 +908,161 @@ class ImageDisplay(object):
         except (EOFError, IOError):
             raise IOError("Error reading from image display")
 
+    def _readinto(self, buf):
+        """Read from image display until the contiguous array (or other
+        writable buffer) buf is full
+
+        Uses os.readv where available, so the data go straight into buf.
+        Raises IOError on failure.
+        """
+        if isinstance(buf, n.ndarray):
+            buf = buf.reshape(-1).view(n.uint8)
+        _view = memoryview(buf)
+        _pos = 0
+        _size = len(_view)
+        try:
+            while _pos < _size:
+                if hasattr(os, 'readv'):
+                    _nread = os.readv(self._fdin, [_view[_pos:]])
+                else:
+                    _data = os.read(self._fdin, _size - _pos)
+                    _nread = len(_data)
+                    _view[_pos:_pos + _nread] = _data
+                if _nread <= 0:
+                    raise IOError("Error reading from image display")
+                _pos += _nread
+        except (EOFError, OSError):
+            raise IOError("Error reading from image display")
+
     def _write(self, s):
         """Write string s to image display
 
         Raises IOError on failure
         """
+        self._writev((s,))
+
+    def _writev(self, buffers):
+        """Write a sequence of strings or contiguous arrays to image display
+
+        The buffers are gathered into as few sendmsg calls as possible
+        and a partial send is resumed from a memoryview slice, so the
+        data are never copied.  Raises IOError on failure
+        """
+        sendmsg = getattr(self._socket, 'sendmsg', None)
+        if sendmsg is None:
+            send = self._socket.send
+            sendmsg = lambda bufs: send(bufs[0])
         try:
-            n = len(s)
-            while n>0:
-                nwritten = self._socket.send(s[-n:])
-                n -= nwritten
-                if nwritten <= 0:
-                    raise IOError("Error writing to image display")
-        except OSError:
+            _sendall(sendmsg, buffers)
+        except (OSError, socket.error):
+            raise IOError("Error writing to image display")
+
+
+def _decode(s):
+
+    """Return the text of a reply from the display, up to any NUL padding"""
+
+    if not isinstance(s, str):
+        s = s.decode('ascii', 'replace')
+    return s.split('\0')[0]
+
+def _encodeHeader(tid,subunit,thingct,x,y,z,t):
+
+    """Return the packed IIS header, with its checksum, for a request"""
+
+    a = [tid & 0xffff, thingct & 0xffff, subunit & 0xffff, 0,
+         x & 0xffff, y & 0xffff, z & 0xffff, t & 0xffff]
+    # The checksum makes the 16-bit sum of the header words 0xffff
+    a[3] = 0xffff - (sum(a) & 0xffff)
+    return _IIS_HEADER.pack(*a)
+
+def _encodeHeaders(tid,subunit,thingct,x,y,z,t):
+
+    """Encode a whole vector of IIS headers into one (nhdr,8) uint16 array.
+
+    Any argument may be a sequence, giving that field for each header;
+    scalar arguments are shared by all headers.  The checksum of the
+    shared fields is computed once and only the varying fields are
+    summed per header.  Each row of the result is a packed header.
+    """
+
+    _fields = (tid, thingct, subunit, 0, x, y, z, t)
+    _nhdr = max([n.size(f) for f in _fields])
+    hdrs = n.empty((_nhdr, 8), dtype=n.uint16)
+    _sum = n.zeros(_nhdr, dtype=n.int64)
+    _const = 0
+    for i,f in enumerate(_fields):
+        if n.ndim(f) == 0:
+            f = int(f) & 0xffff
+            _const += f
+        else:
+            f = n.asarray(f, dtype=n.int64) & 0xffff
+            _sum += f
+        hdrs[:,i] = f
+    _sum += _const
+    hdrs[:,3] = 0xffff - (_sum & 0xffff)
+    return hdrs
+
+def _rowruns(changed):
+    """Return the list of (start, end) of the runs of True values of the
+    boolean array 'changed'."""
+
+    _edges = n.flatnonzero(n.diff(n.concatenate(([False], changed, [False]))))
+    return list(zip(_edges[0::2].tolist(), _edges[1::2].tolist()))
+
+def imageDigest(pix,wcsinfo):
+    """Return a digest identifying the image pix as placed in the frame
+    buffer by writeImage with wcsinfo: its shape, its position and a
+    CRC-32 of its bytes."""
+
+    _crc = 0
+    for _buf in _rowbuffers(pix):
+        _crc = zlib.crc32(_buf, _crc)
+    return (pix.shape, wcsinfo.nx, wcsinfo.ny, wcsinfo.dtx, wcsinfo.dty,
+            _crc & 0xffffffff)
+
+def _rowbuffers(pix):
+    """Return a list of contiguous buffers holding the bytes of 'pix'
+    in C order, without copying as long as each row is contiguous
+    (for example, a row-flipped view of an image)."""
+
+    if pix.flags.c_contiguous:
+        return [pix]
+    if pix.ndim == 2 and pix.strides[1] == pix.itemsize:
+        return list(pix)
+    return [n.ascontiguousarray(pix)]
+
+def _sendall(sendv, buffers):
+    """Write all 'buffers' using 'sendv', which takes a list of buffers
+    and returns the number of bytes written (such as socket.sendmsg or
+    os.writev).
+
+    Partially written buffers are resumed through memoryview slices,
+    so no data are copied.  Raises IOError if nothing could be written.
+    """
+
+    _bufs = []
+    for buf in buffers:
+        if isinstance(buf, n.ndarray):
+            buf = buf.reshape(-1).view(n.uint8)
+        buf = memoryview(buf)
+        if len(buf):
+            _bufs.append(buf)
+
+    i = 0
+    while i < len(_bufs):
+        nwritten = sendv(_bufs[i:i + _IOV_MAX])
+        if nwritten <= 0:
             raise IOError("Error writing to image display")
+        # skip over whatever has been written, trimming a partial buffer
+        while nwritten > 0:
+            nbuf = len(_bufs[i])
+            if nwritten >= nbuf:
+                nwritten -= nbuf
+                i += 1
+            else:
+                _bufs[i] = _bufs[i][nwritten:]
+                nwritten = 0
 
 
 class FifoImageDisplay(ImageDisplay):
@@ -603,18 +1082,19 @@ class FifoImageDisplay(ImageDisplay):
         except OSError as error:
             raise IOError("Cannot open image display (%s)" % (error,))
 
-    def _write(self, s):
-        """Write string s to image display
+    def _writev(self, buffers):
+        """Write a sequence of strings or contiguous arrays to image display
 
-        Raises IOError on failure
+        Uses os.writev where available so that headers and pixel rows go
+        out together without being copied.  Raises IOError on failure
         """
+        fd = self._fdout
+        if hasattr(os, 'writev'):
+            writev = lambda bufs: os.writev(fd, bufs)
+        else:
+            writev = lambda bufs: os.write(fd, bufs[0])
         try:
-            n = len(s)
-            while n>0:
-                nwritten = os.write(self._fdout, s[-n:])
-                n -= nwritten
-                if nwritten <= 0:
-                    raise IOError("Error writing to image display")
+            _sendall(writev, buffers)
         except OSError:
             raise IOError("Error writing to image display")
 
@@ -0,0 +1,425 @@
+"""iisserver.py: In-process IIS image display server
+
+A minimal, pure-Python stand-in for ds9/ximtool which speaks the IIS
+protocol used by displaydev.  It keeps the frame buffers in memory as
+numpy uint8 arrays, so that numdisplay.display and the overlay functions
+can be exercised (and timed) without a GUI.
+
+The server understands the following packets:
+
+    _MEMORY     writes into, and reads back from, the frame buffers
+    _WCS        stores, and returns, the WCS string of each frame
+    _LUT        selects the active frame (the only LUT command used)
+    _FEEDBACK   erases frames and sets their frame buffer configuration
+    _IMCURSOR   returns, or moves, the cursor position
+
+Example::
+
+    >>> from stsci.numdisplay import iisserver
+    >>> server = iisserver.IISServer('inet:0').start()
+    >>> numdisplay.open(server.imtdev)
+    >>> numdisplay.display(a)
+    >>> server.frames[1]          # frame buffer contents of frame 1
+    >>> server.stop()
+
+The server address uses the same syntax as the imtdev argument of
+displaydev.open; an 'inet' port of 0 picks a free port, and the actual
+address is then available as the 'imtdev' attribute.  The frame buffer
+contents are stored as addressed by the IIS requests, that is with the
+first line of the array at the top of the display.
+
+"""
+from __future__ import absolute_import, division, print_function # confidence high
+
+import os, select, socket, struct, tempfile, threading
+
+import numpy as n
+from . import imconfig
+from .displaydev import ImageDisplay, _IIS_HEADER, _default_fbconfig
+
+_SZ_HEADER = _IIS_HEADER.size
+_UNIT = 0o77
+
+# Names of the IIS subunits, used for the packet counts
+_UNITNAMES = {ImageDisplay._MEMORY: 'memory', ImageDisplay._LUT: 'lut',
+              ImageDisplay._FEEDBACK: 'feedback',
+              ImageDisplay._IMCURSOR: 'imcursor', ImageDisplay._WCS: 'wcs'}
+
+_default_wcs = "none\n1.0 0.0 0.0 -1.0 0 %d 0.0 0.0 0"
+
+
+class IISServer(object):
+
+    """In-memory IIS display server listening on a unix, inet or fifo
+    endpoint.
+
+    Parameters
+    ----------
+    imtdev : str
+        address to listen on, such as 'unix:/tmp/.IMT%d', 'inet:5137' or
+        'fifo:/dev/imt1i:/dev/imt1o'.  The default is a unix socket in a
+        temporary directory (or a free inet port where unix sockets are
+        not available).
+
+    fbconfig : int
+        frame buffer configuration (imtoolrc entry) used for frames
+        which have not been configured by the client
+
+    wcsformat : str
+        if given, a format such as '%g' which the numbers of each WCS
+        string are rewritten with when it is stored, as ds9 and ximtool
+        do; by default, WCS strings are stored as they are written
+
+    Attributes
+    ----------
+    frames : dict
+        uint8 frame buffer array of each frame, keyed by frame number
+    wcs : dict
+        WCS string last written to each frame
+    fbconfig : dict
+        frame buffer configuration number of each frame
+    frame : int
+        active frame number
+    cursor : tuple
+        (x, y, key) returned for cursor reads; moved by setCursor
+    packets : dict
+        number of packets received, keyed by subunit name
+    nbytes : int
+        number of bytes received, headers included
+    """
+
+    def __init__(self, imtdev=None, fbconfig=_default_fbconfig,
+                 wcsformat=None):
+
+        self.fbdict = imconfig.loadImtoolrc()
+        self.default_fbconfig = fbconfig
+        self.wcsformat = wcsformat
+
+        self.frames = {}
+        self.wcs = {}
+        self.fbconfig = {}
+        self.frame = 1
+        self.cursor = (1.0, 1.0, 'q')
+
+        self._lock = threading.RLock()
+        self._threads = []
+        self._running = False
+        self._listener = None
+        self._fifos = None
+        self._tmpdir = None
+
+        self.reset()
+
+        if imtdev is None:
+            if hasattr(socket, 'AF_UNIX'):
+                self._tmpdir = tempfile.mkdtemp()
+                imtdev = 'unix:' + os.path.join(self._tmpdir, '.IMT%d')
+            else:
+                imtdev = 'inet:0'
+        self.imtdev = self._bind(imtdev)
+
+    def reset(self):
+        """ Clear all frames and the packet counts."""
+        with self._lock:
+            self.frames.clear()
+            self.wcs.clear()
+            self.fbconfig.clear()
+            self.frame = 1
+            self.packets = dict.fromkeys(_UNITNAMES.values(), 0)
+            self.nbytes = 0
+
+    def getFrame(self, frame=None):
+        """ Return the frame buffer of a frame (default: active frame),
+        allocating it if necessary."""
+        if frame is None:
+            frame = self.frame
+        with self._lock:
+            if frame not in self.frames:
+                self._configure(frame, self.default_fbconfig)
+            return self.frames[frame]
+
+    def _configure(self, frame, fbconfig):
+        """ Set the frame buffer configuration of a frame, reallocating its
+        buffer if the size changes."""
+        if fbconfig not in self.fbdict:
+            fbconfig = self.default_fbconfig
+        _fb = self.fbdict[fbconfig]
+        _shape = (_fb['height'], _fb['width'])
+        if frame not in self.frames or self.frames[frame].shape != _shape:
+            self.frames[frame] = n.zeros(_shape, dtype=n.uint8)
+        self.fbconfig[frame] = fbconfig
+
+    # ------------------------------------------------------------------
+    # Endpoint management
+
+    def _bind(self, imtdev):
+        """ Create the listening endpoint and return its actual address."""
+        nd = len(imtdev.split("%d"))
+        if nd > 1:
+            dev = imtdev % ((abs(os.getpid()),)*(nd-1))
+        else:
+            dev = imtdev
+        fields = dev.split(":")
+        domain = fields[0]
+        if domain == "unix" and len(fields) == 2:
+            if os.path.exists(fields[1]):
+                os.unlink(fields[1])
+            self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._listener.bind(fields[1])
+            self._listener.listen(5)
+            self._path = fields[1]
+            return dev
+        elif domain == "inet" and (2 <= len(fields) <= 3):
+            hostname = len(fields) == 3 and fields[2] or "localhost"
+            self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._listener.setsockopt(socket.SOL_SOCKET,
+                                      socket.SO_REUSEADDR, 1)
+            self._listener.bind((hostname, int(fields[1])))
+            self._listener.listen(5)
+            port = self._listener.getsockname()[1]
+            return "inet:%d:%s" % (port, hostname)
+        elif domain == "fifo" and len(fields) == 3:
+            # The client reads the first fifo and writes the second one.
+            for name in fields[1:]:
+                if not os.path.exists(name):
+                    os.mkfifo(name)
+            # Opening both ends read/write (as Linux allows) keeps the
+            # opens from blocking and reads from hitting EOF whenever
+            # the client disconnects.
+            fdout = os.open(fields[1], os.O_RDWR)
+            fdin = os.open(fields[2], os.O_RDWR)
+            self._fifos = (fdin, fdout)
+            return dev
+        raise ValueError("Illegal image device specification `%s'"
+                                        % imtdev)
+
+    def start(self):
+        """ Start serving requests in background threads; returns self."""
+        self._running = True
+        if self._fifos:
+            fdin, fdout = self._fifos
+            self._spawn(self._serve, _FifoChannel(fdin, fdout))
+        else:
+            self._spawn(self._accept)
+        return self
+
+    def _spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self):
+        """ Stop serving and release the endpoint."""
+        self._running = False
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+            if hasattr(self, '_path') and os.path.exists(self._path):
+                os.unlink(self._path)
+        if self._fifos:
+            for fd in self._fifos:
+                os.close(fd)
+            self._fifos = None
+        if self._tmpdir:
+            os.rmdir(self._tmpdir)
+            self._tmpdir = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _accept(self):
+        while self._running:
+            if not select.select([self._listener], [], [], 0.05)[0]:
+                continue
+            conn = self._listener.accept()[0]
+            self._spawn(self._serve, _SocketChannel(conn))
+
+    def _serve(self, channel):
+        try:
+            while self._running:
+                try:
+                    hdr = channel.recv(_SZ_HEADER, self)
+                except EOFError:
+                    break
+                self._dispatch(channel, _IIS_HEADER.unpack(hdr))
+        finally:
+            channel.close()
+
+    # ------------------------------------------------------------------
+    # Packet decoding
+
+    def _dispatch(self, channel, hdr):
+        tid, thingct, subunit, checksum, x, y, z, t = hdr
+        if sum(hdr) & 0xffff != 0xffff:
+            raise IOError("Bad IIS header checksum")
+        if thingct & 0x8000:
+            thingct -= 0x10000
+        unit = subunit & _UNIT
+        reading = tid & ImageDisplay._IIS_READ
+
+        # Counts are in bytes for packed data, 16-bit words otherwise
+        if thingct < 0:
+            nbytes = -thingct
+        else:
+            nbytes = thingct
+        if not tid & ImageDisplay._PACKED:
+            nbytes *= 2
+
+        data = b''
+        if not reading and nbytes > 0:
+            data = channel.recv(nbytes, self)
+
+        with self._lock:
+            self.nbytes += _SZ_HEADER + len(data)
+            name = _UNITNAMES.get(unit)
+            if name:
+                self.packets[name] += 1
+
+            x &= 0x7fff
+            y &= 0x7fff
+            reply = None
+            if unit == ImageDisplay._MEMORY:
+                reply = self._memory(reading, nbytes, x, y, z, data)
+            elif unit == ImageDisplay._LUT:
+                if subunit & ImageDisplay._COMMAND and len(data) >= 2:
+                    self.frame = _lowbit(struct.unpack('H', data[:2])[0])
+            elif unit == ImageDisplay._FEEDBACK:
+                for frame in _frames(z):
+                    self._configure(frame, (tid & _UNIT) + 1)
+                    self.frames[frame][...] = 0
+            elif unit == ImageDisplay._WCS:
+                reply = self._wcs(reading, z, t, data)
+            elif unit == ImageDisplay._IMCURSOR:
+                if reading:
+                    _x, _y, key = self.cursor
+                    s = "%10.3f %10.3f %d %s\n" % (_x, _y,
+                                                   self.frame * 100 + 1, key)
+                    reply = _pad(s, ImageDisplay._SZ_IMCURVAL)
+                else:
+                    self.cursor = (float(x), float(y), self.cursor[2])
+        if reply is not None:
+            channel.send(reply)
+
+    def _memory(self, reading, nbytes, x, y, z, data):
+        # Data run on from one frame buffer line into the next
+        frames = _frames(z) or [self.frame]
+        if reading:
+            fb = self.getFrame(frames[0])
+            start = min(y * fb.shape[1] + x, fb.size)
+            reply = fb.reshape(-1)[start:start + nbytes].tobytes()
+            return reply + b'\0' * (nbytes - len(reply))
+        pix = n.frombuffer(data, dtype=n.uint8)
+        for frame in frames:
+            fb = self.getFrame(frame)
+            start = min(y * fb.shape[1] + x, fb.size)
+            end = min(start + pix.size, fb.size)
+            fb.reshape(-1)[start:end] = pix[:end - start]
+        return None
+
+    def _wcs(self, reading, z, t, data):
+        frame = _lowbit(z) or self.frame
+        if reading:
+            if frame in self.wcs:
+                s = self.wcs[frame]
+            else:
+                s = _default_wcs % self.getFrame(frame).shape[0]
+            return _pad(s, ImageDisplay._SZ_WCSBUF)
+        self._configure(frame, t + 1)
+        s = data.decode('ascii', 'replace')
+        if self.wcsformat:
+            s = _reformat(s, self.wcsformat)
+        self.wcs[frame] = s
+        return None
+
+
+def _reformat(wcsstr, fmt):
+    """ WCS string with each number after the name line written with fmt."""
+    name, _, values = wcsstr.partition('\n')
+    fields = []
+    for value in values.split():
+        try:
+            value = fmt % float(value)
+        except ValueError:
+            pass
+        fields.append(value)
+    return name + '\n' + ' '.join(fields)
+
+
+def _frames(z):
+    """ List of frame numbers selected by the IIS frame bit mask z."""
+    return [i + 1 for i in range(16) if z & (1 << i)]
+
+def _lowbit(z):
+    """ Lowest frame number selected by the frame bit mask z, or 0."""
+    frames = _frames(z)
+    return frames and frames[0] or 0
+
+def _pad(s, size):
+    """ Encode s as a NUL-padded reply of exactly size bytes."""
+    s = s.encode('ascii', 'replace')[:size]
+    return s + b'\0' * (size - len(s))
+
+
+class _SocketChannel(object):
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def recv(self, nbytes, server):
+        chunks = []
+        while nbytes > 0:
+            if not server._running:
+                raise EOFError
+            if not select.select([self._conn], [], [], 0.05)[0]:
+                continue
+            chunk = self._conn.recv(nbytes)
+            if not chunk:
+                raise EOFError
+            chunks.append(chunk)
+            nbytes -= len(chunk)
+        return b''.join(chunks)
+
+    def send(self, data):
+        self._conn.sendall(data)
+
+    def close(self):
+        self._conn.close()
+
+
+class _FifoChannel(object):
+
+    def __init__(self, fdin, fdout):
+        self._fdin = fdin
+        self._fdout = fdout
+
+    def recv(self, nbytes, server):
+        chunks = []
+        while nbytes > 0:
+            if not server._running:
+                raise EOFError
+            if not select.select([self._fdin], [], [], 0.05)[0]:
+                continue
+            chunk = os.read(self._fdin, nbytes)
+            chunks.append(chunk)
+            nbytes -= len(chunk)
+        return b''.join(chunks)
+
+    def send(self, data):
+        while data:
+            data = data[os.write(self._fdout, data):]
+
+    def close(self):
+        # The fifos belong to the server and are closed by stop()
+        pass
+
+
+# Print help information
+def help():
+    print(__doc__)
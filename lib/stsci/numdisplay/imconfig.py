@@ -94,7 +94,7 @@ def loadImtoolrc(imtoolrc=None):
     
     for line in _lines:
         # Strip out any blanks/tabs
-        line = string.strip(line)
+        line = line.strip()
         # Ignore empty lines
         if len(line) > 1:
             _lsp = line.split()
@@ -0,0 +1,239 @@
+"""imfile.py: Memory mapped images from .npy, FITS and raw files
+
+openImage(filename, shape=None, dtype=None, offset=0, ext=None)
+    Return a 2-d image stored in a file without reading it into memory.
+    The file is opened with numpy.memmap, so that only the parts of the
+    image which are actually used (such as the section which fits in the
+    frame buffer and the rows sampled by zscale) get paged in.
+
+    Supported files are:
+
+        .npy files      any 2-d array saved by numpy.save
+        FITS files      image HDUs, selected by 'ext' (number or EXTNAME);
+                        by default, the first HDU with a 2-d image
+        raw files       any other file, given 'shape' and 'dtype' of the
+                        image, which starts 'offset' bytes into the file
+
+    A FITS image with BSCALE/BZERO scaling is returned as a ScaledImage,
+    which applies the scaling to each slice as it is read.  The usual
+    unsigned integer convention (BZERO = 2**(BITPIX-1)) is mapped onto
+    the corresponding unsigned type.
+
+isLazyImage(pix)
+    Return True if pix is a memmap, or any other object with shape, dtype
+    and __getitem__ which is not a numpy array (a ScaledImage, an HDF5
+    dataset, a chunked array...).  numdisplay.display only reads slices
+    of such images, rather than converting them to arrays.
+
+readFitsHeaders(filename)
+    Return the list of (header, data offset) of the HDUs of a FITS file,
+    using a simple header parser (no external FITS library is needed).
+
+"""
+from __future__ import absolute_import, division, print_function # confidence high
+
+import numpy as n
+
+_FITS_BLOCK = 2880
+_FITS_CARD = 80
+
+_BITPIX = {8: 'u1', 16: '>i2', 32: '>i4', 64: '>i8', -32: '>f4', -64: '>f8'}
+
+
+class ScaledImage(object):
+
+    """ Image stored as integers with a linear scaling, read lazily.
+
+    Slicing returns raw[key] * bscale + bzero (or the equivalent unsigned
+    integers for the unsigned convention), so only the requested section
+    of the underlying array (such as a memmap) is ever read.
+    """
+
+    def __init__(self, raw, bscale=1., bzero=0.):
+        self.raw = raw
+        self.bscale = bscale
+        self.bzero = bzero
+        self._unsigned = False
+        _kind = raw.dtype.kind
+        _nbits = 8 * raw.dtype.itemsize
+        if bscale == 1 and _kind in 'ui':
+            if _kind == 'i' and bzero == 2 ** (_nbits - 1):
+                self._unsigned = True
+                self.dtype = n.dtype('u%d' % (_nbits // 8))
+            elif _kind == 'u' and bzero == -2 ** (_nbits - 1):
+                self._unsigned = True
+                self.dtype = n.dtype('i%d' % (_nbits // 8))
+        if not self._unsigned:
+            self.dtype = n.dtype(n.float64)
+        self.shape = raw.shape
+        self.ndim = raw.ndim
+        self.size = raw.size
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        _raw = n.asarray(self.raw[key])
+        if self._unsigned:
+            # Adding 2**(nbits-1) just flips the sign bit; the result is
+            # in native byte order
+            _signbit = 1 << (8 * _raw.dtype.itemsize - 1)
+            _bits = _raw.view(_raw.dtype.byteorder + 'u%d' % _raw.itemsize)
+            return (_bits ^ _signbit).astype(_bits.dtype.newbyteorder('='),
+                                            copy=False).view(self.dtype)
+        return _raw * n.float64(self.bscale) + n.float64(self.bzero)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self[...]
+        return self[...].astype(dtype)
+
+
+def isLazyImage(pix):
+    """ Return True if pix is a memmap or an array-like object which should
+    only be sliced (it has shape, dtype and __getitem__ but is not a numpy
+    array)."""
+
+    if isinstance(pix, n.ndarray):
+        return isinstance(pix, n.memmap)
+    return (hasattr(pix, 'shape') and hasattr(pix, 'dtype') and
+            hasattr(pix, '__getitem__'))
+
+def _cardValue(card):
+    """ Value of a FITS header card, as str, bool, int or float."""
+    _val = card[10:].strip()
+    if _val.startswith("'"):
+        # String values end with the first single quote that is not doubled
+        _s = _val[1:]
+        _end = 0
+        while True:
+            _end = _s.find("'", _end)
+            if _end < 0 or _s[_end + 1:_end + 2] != "'":
+                break
+            _end += 2
+        return _s[:_end].replace("''", "'").rstrip()
+    _val = _val.split('/')[0].strip()
+    if _val == 'T':
+        return True
+    if _val == 'F':
+        return False
+    try:
+        return int(_val)
+    except ValueError:
+        pass
+    try:
+        return float(_val.replace('D', 'E'))
+    except ValueError:
+        return _val
+
+def readFitsHeaders(filename):
+    """ Return the list of (header, data offset) of the HDUs of a FITS file.
+
+    Each header is a dictionary of the keyword values; commentary cards
+    are ignored.  Raises ValueError if filename is not a FITS file.
+    """
+
+    hdus = []
+    f = open(filename, 'rb')
+    try:
+        _pos = 0
+        while True:
+            header = {}
+            _end = False
+            while not _end:
+                block = f.read(_FITS_BLOCK)
+                if len(block) < _FITS_BLOCK:
+                    if not hdus and not header:
+                        raise ValueError("%s is not a FITS file" % filename)
+                    return hdus
+                _pos += _FITS_BLOCK
+                block = block.decode('ascii', 'replace')
+                if not hdus and not header and not block.startswith('SIMPLE'):
+                    raise ValueError("%s is not a FITS file" % filename)
+                for i in range(0, _FITS_BLOCK, _FITS_CARD):
+                    card = block[i:i + _FITS_CARD]
+                    key = card[:8].strip()
+                    if key == 'END':
+                        _end = True
+                        break
+                    if card[8:10] == '= ':
+                        header[key] = _cardValue(card)
+            hdus.append((header, _pos))
+
+            # Skip over the data, padded to a whole number of blocks
+            _naxis = header.get('NAXIS', 0)
+            _npix = 0
+            if _naxis:
+                _npix = 1
+                for i in range(1, _naxis + 1):
+                    _npix *= header.get('NAXIS%d' % i, 0)
+            _nbytes = (abs(header.get('BITPIX', 8)) // 8 *
+                       header.get('GCOUNT', 1) *
+                       (header.get('PCOUNT', 0) + _npix))
+            _nbytes = (_nbytes + _FITS_BLOCK - 1) // _FITS_BLOCK * _FITS_BLOCK
+            _pos += _nbytes
+            f.seek(_pos)
+    finally:
+        f.close()
+
+def _openFits(filename, ext=None, mode='r'):
+    hdus = readFitsHeaders(filename)
+    for i, (header, offset) in enumerate(hdus):
+        _naxes = [header.get('NAXIS%d' % j, 0)
+                  for j in range(header.get('NAXIS', 0), 0, -1)]
+        if ext is None:
+            _xtension = header.get('XTENSION', 'IMAGE')
+            if _xtension not in ('IMAGE', 'IMAGE   ') or len(_naxes) < 2:
+                continue
+        elif ext != i and ext != header.get('EXTNAME'):
+            continue
+        if len(_naxes) < 2 or 0 in _naxes:
+            raise ValueError("HDU %s of %s is not an image" % (i, filename))
+        raw = n.memmap(filename, dtype=_BITPIX[header['BITPIX']], mode=mode,
+                       offset=offset, shape=tuple(_naxes))
+        # Display the first plane of a cube
+        while raw.ndim > 2:
+            raw = raw[0]
+        bscale = header.get('BSCALE', 1.)
+        bzero = header.get('BZERO', 0.)
+        if bscale != 1 or bzero != 0:
+            return ScaledImage(raw, bscale, bzero)
+        return raw
+    raise ValueError("No image HDU %s found in %s" % (ext, filename))
+
+def openImage(filename, shape=None, dtype=None, offset=0, ext=None, mode='r'):
+    """ Return the image stored in a file as a memory mapped array.
+
+    Parameters
+    ----------
+    filename : str
+        name of a .npy, FITS or raw image file
+
+    shape, dtype : tuple, dtype
+        shape and data type of the image in a raw file
+
+    offset : int
+        byte offset of the image in a raw file
+
+    ext : int or str
+        number or EXTNAME of the FITS HDU (default: first 2-d image)
+
+    mode : str
+        memmap access mode
+
+    Returns
+    -------
+    numpy.memmap, or ScaledImage for scaled FITS images
+    """
+
+    if shape is not None or dtype is not None:
+        if shape is None or dtype is None:
+            raise ValueError("Both shape and dtype are needed for raw files")
+        return n.memmap(filename, dtype=dtype, mode=mode, offset=offset,
+                        shape=tuple(shape))
+    if filename.endswith('.npy'):
+        return n.load(filename, mmap_mode=mode)
+    return _openFits(filename, ext=ext, mode=mode)
+
+def help():
+    print(__doc__)
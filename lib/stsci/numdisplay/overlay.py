@@ -147,7 +147,8 @@ def _checkColor (color=None):
 def _update_save (fd, x, y, list_of_points, last_overlay, undo=True):
     """Save info in local lists list_of_points and last_overlay.
 
-    @param fd: for reading from image display
+    @param fd: for reading from image display (values are taken from the
+        client-side shadow of the frame when it is known)
     @type fd: file handle
     @param x: X coordinate (IIS convention, not image coordinates)
     @type x: int
@@ -164,10 +165,12 @@ def _update_save (fd, x, y, list_of_points, last_overlay, undo=True):
     global global_byte_buf
     if undo:
         if (x, y) not in list_of_points:
-            value = fd.readData (x, y, global_byte_buf)
-            value = struct.unpack ('B', value)
+            value = fd.shadowValue (x, y)
+            if value is None:
+                value = fd.readData (x, y, global_byte_buf)
+                value = struct.unpack ('B', value)[0]
             list_of_points.append ((x, y))
-            last_overlay.append ((x, y, value[0]))
+            last_overlay.append ((x, y, value))
 
 def point (**kwargs):
     """Draw a point.
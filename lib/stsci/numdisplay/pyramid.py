@@ -0,0 +1,114 @@
+"""pyramid.py: Cache of byte-scaled tiles of an image at several resolutions
+
+An ImagePyramid holds the byte-scaled (uint8) version of an image, and of
+the image reduced by factors of 2, 4, 8, ... (its levels), cut into square
+tiles which are only computed when they are first needed:
+
+    - a tile of level 0 is byte-scaled from the corresponding section of
+      the image by the 'scale' function (the only time the image itself is
+      read; the function may reduce the image by a block factor before
+      scaling it, see numdisplay.display(fit='bin'));
+
+    - a tile of level k is the mean of each 2x2 block of pixels of the
+      (up to 4) tiles of level k-1 which it covers.
+
+Panning over an image, or zooming in and out, then only scales the parts
+of the image which were never shown before.  Level k has shape
+(ny >> k, nx >> k): a pixel left over at the end of an odd row or
+column is dropped, so that pixel i of level k always stands for the
+pixels [i * 2**k, (i + 1) * 2**k) of level 0.
+
+Since the levels above 0 average byte-scaled pixels, they only match the
+image reduced before scaling when the scaling is linear and no pixel
+gets clipped to z1 or z2; with a transform such as numpy.log (or with
+clipped pixels), they differ from it.
+
+    ImagePyramid(shape, scale, tilesize=TILE_SIZE)::
+        'shape' is the shape of level 0, and scale(y0, y1, x0, x1) the
+        function which returns its byte-scaled pixels [y0:y1, x0:x1].
+
+    region(level, y0, x0, y1, x1)::
+        Return the uint8 pixels [y0:y1, x0:x1] of a level; pixels outside
+        the level are 0.
+
+"""
+from __future__ import absolute_import, division # confidence high
+
+import numpy as n
+
+# Edge length of the tiles
+TILE_SIZE = 512
+
+
+class ImagePyramid(object):
+
+    """ Lazily computed, byte-scaled tiles of an image at all resolutions."""
+
+    def __init__(self, shape, scale, tilesize=TILE_SIZE):
+        self.scale = scale
+        self.tilesize = tilesize
+        self.shape = tuple(shape)
+        self._tiles = {}
+
+        # Levels go down to the first one which fits in a single tile
+        self.nlevels = 1
+        while (max(self.levelshape(self.nlevels - 1)) > tilesize and
+               min(self.levelshape(self.nlevels)) > 0):
+            self.nlevels += 1
+
+    def levelshape(self, level):
+        """ Shape of the image at the given level."""
+        return (self.shape[0] >> level, self.shape[1] >> level)
+
+    def clear(self):
+        """ Forget all the tiles computed so far."""
+        self._tiles.clear()
+
+    def tile(self, level, row, col):
+        """ Return the uint8 tile (row, col) of a level, computing it (and
+        the tiles of the finer levels it depends on) if needed."""
+
+        _key = (level, row, col)
+        _tile = self._tiles.get(_key)
+        if _tile is not None:
+            return _tile
+
+        _ny, _nx = self.levelshape(level)
+        _y0 = row * self.tilesize
+        _x0 = col * self.tilesize
+        _y1 = min(_y0 + self.tilesize, _ny)
+        _x1 = min(_x0 + self.tilesize, _nx)
+        if level == 0:
+            # The scaling function may return a reused buffer: keep a copy
+            _tile = n.array(self.scale(_y0, _y1, _x0, _x1), dtype=n.uint8)
+        else:
+            _fine = self.region(level - 1, 2 * _y0, 2 * _x0, 2 * _y1, 2 * _x1)
+            _sum = _fine.reshape(_y1 - _y0, 2, _x1 - _x0, 2).sum(axis=3,
+                                                                 dtype=n.uint16)
+            _sum = _sum.sum(axis=1, dtype=n.uint16)
+            _sum += 2
+            _sum //= 4
+            _tile = _sum.astype(n.uint8)
+        self._tiles[_key] = _tile
+        return _tile
+
+    def region(self, level, y0, x0, y1, x1):
+        """ Return the uint8 array of the pixels [y0:y1, x0:x1] of a level,
+        where pixels outside of the level are set to 0."""
+
+        out = n.zeros((y1 - y0, x1 - x0), dtype=n.uint8)
+        _ny, _nx = self.levelshape(level)
+        _size = self.tilesize
+        for row in range(max(y0, 0) // _size, (min(y1, _ny) - 1) // _size + 1):
+            for col in range(max(x0, 0) // _size,
+                             (min(x1, _nx) - 1) // _size + 1):
+                _tile = self.tile(level, row, col)
+                # Overlap of the tile with the region, in level pixels
+                _ty0 = max(row * _size, y0)
+                _tx0 = max(col * _size, x0)
+                _ty1 = min(row * _size + _tile.shape[0], y1)
+                _tx1 = min(col * _size + _tile.shape[1], x1)
+                out[_ty0 - y0:_ty1 - y0, _tx0 - x0:_tx1 - x0] = \
+                    _tile[_ty0 - row * _size:_ty1 - row * _size,
+                          _tx0 - col * _size:_tx1 - col * _size]
+        return out
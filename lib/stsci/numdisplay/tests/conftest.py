@@ -0,0 +1,16 @@
+from __future__ import absolute_import, division # confidence high
+
+import pytest
+
+import stsci.numdisplay as numdisplay
+from stsci.numdisplay import iisserver
+
+
+@pytest.fixture(scope='module')
+def server():
+    """ An in-process IIS server, which numdisplay is connected to."""
+    srv = iisserver.IISServer().start()
+    numdisplay.open(srv.imtdev)
+    yield srv
+    numdisplay.close()
+    srv.stop()
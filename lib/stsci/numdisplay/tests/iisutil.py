@@ -0,0 +1,33 @@
+"""Helpers for the tests which display images on the in-process IIS server
+(see the 'server' fixture of conftest.py)."""
+from __future__ import absolute_import, division # confidence high
+
+import numpy as n
+
+import stsci.numdisplay as numdisplay
+
+
+def device():
+    """ The ImageDisplay numdisplay is connected to."""
+    return numdisplay.view.view._display
+
+def show(pix, **kwargs):
+    """ Display pix quietly, and wait until the server has consumed
+    everything (a WCS read is a round trip); returns the device."""
+    numdisplay.display(pix, quiet=True, **kwargs)
+    _d = device()
+    _d.readInfo()
+    return _d
+
+def expected(pix, z1, z2, fbwidth, fbheight):
+    """ Frame buffer expected for pix displayed with z1, z2: pixels scaled
+    linearly from 1 to 200, centered, with the first image row at the
+    bottom."""
+    out = n.zeros((fbheight, fbwidth), dtype=n.uint8)
+    scaled = (n.asarray(pix, dtype=n.float64) - z1) * (199. / (z2 - z1)) + 1.
+    scaled = n.clip(scaled, 1., 200.).astype(n.uint8)
+    ny, nx = scaled.shape
+    lx = fbwidth // 2 - nx // 2
+    ly = fbheight - int(fbheight + ny / 2. - fbheight / 2. + 0.5)
+    out[ly:ly + ny, lx:lx + nx] = scaled[::-1]
+    return out
@@ -0,0 +1,167 @@
+"""Tests of the frame buffer writes of displaydev.ImageDisplay, against the
+in-process IIS server."""
+from __future__ import absolute_import, division # confidence high
+
+import numpy as n
+import pytest
+
+import stsci.numdisplay as numdisplay
+from stsci.numdisplay import displaydev, iisserver
+
+from .iisutil import device, expected, show
+
+
+def _send(server, pix, blocksize, **kwargs):
+    """ Display pix in full using 'blocksize', and return the number of
+    _MEMORY packets it took."""
+    _d = device()
+    _d.invalidate()
+    _d.blocksize = blocksize
+    _m0 = server.packets['memory']
+    try:
+        show(pix, bufname='imt512', z1=0, z2=1000, **kwargs)
+    finally:
+        _d.blocksize = displaydev.SZ_BLOCK
+    return server.packets['memory'] - _m0
+
+@pytest.mark.parametrize('lines', [1, 5, 64])
+def test_row_packing(server, lines):
+    # A full width image is sent 'lines' rows per packet; with 5 rows the
+    # last packet holds the 2 rows left over.
+    rng = n.random.RandomState(lines)
+    pix = rng.rand(512, 512) * 1000
+    npackets = _send(server, pix, lines * 512 + 100)
+    assert npackets == -(-512 // lines)
+    _d = device()
+    assert (server.frames[_d.frame] == expected(pix, 0, 1000, 512, 512)).all()
+
+@pytest.mark.parametrize('blocksize,npackets', [(displaydev.SZ_BLOCK, 200),
+                                                (100, 600)])
+def test_narrow_rows(server, blocksize, npackets):
+    # Narrower images go one row per packet, split into segments of at
+    # most 'blocksize' bytes.
+    rng = n.random.RandomState(blocksize)
+    pix = rng.rand(200, 300) * 1000
+    assert _send(server, pix, blocksize) == npackets
+    _d = device()
+    assert (server.frames[_d.frame] == expected(pix, 0, 1000, 512, 512)).all()
+
+def test_wcs_zero_range():
+    # A range given as 0 is kept, not replaced by the image range, and the
+    # image range ignores NaNs.
+    pix = n.arange(100.).reshape(10, 10) + 5.
+    pix[3, 3] = n.nan
+    wcs = displaydev.ImageWCS(pix, z1=0, z2=50)
+    assert (wcs.z1, wcs.z2) == (0, 50)
+    wcs = displaydev.ImageWCS(pix, z1=0)
+    assert (wcs.z1, wcs.z2) == (0, 104.)
+    wcs = displaydev.ImageWCS(pix)
+    assert (wcs.z1, wcs.z2) == (5., 104.)
+
+def test_same_wcs():
+    wcs = 'test\n3.0 0.0 0.0 -3.0 -56.0 1253.0 0.123456789 2500.5 1\n'
+    assert displaydev._sameWCS(wcs, wcs.rstrip())
+    assert displaydev._sameWCS(
+        wcs, 'test \n3 0 0 -3 -56 1253 0.123457 2500.5 1')
+    assert not displaydev._sameWCS(
+        wcs, 'test\n3 0 0 -3 -56 1254 0.123457 2500.5 1')
+    assert not displaydev._sameWCS(
+        wcs, 'other\n3 0 0 -3 -56 1253 0.123457 2500.5 1')
+    assert not displaydev._sameWCS(wcs, 'test\n3 0 0 -3 -56 1253')
+
+def _displays(server, pix, **kwargs):
+    """ Display pix, and return the (_MEMORY, _WCS) packets it took."""
+    m0, w0 = server.packets['memory'], server.packets['wcs']
+    show(pix, bufname='imt512', **kwargs)
+    return server.packets['memory'] - m0, server.packets['wcs'] - w0
+
+def test_resident(server):
+    rng = n.random.RandomState(12)
+    pix = rng.rand(512, 512) * 1000
+    _d = show(pix, bufname='imt512', z1=0.1234567, z2=1000.5)
+    expect = server.frames[_d.frame].copy()
+
+    # Displaying the same image again only reads the WCS back (the
+    # writeImage digest, not the shadow, makes this so)
+    assert _displays(server, pix, z1=0.1234567, z2=1000.5)[0] == 0
+
+    # Another client loads something else into the frame: the same
+    # display is then sent again in full
+    server.frames[_d.frame][...] = 7
+    server.wcs[_d.frame] = 'other\n1. 0. 0. -1. 0 512 0. 1. 1'
+    assert _displays(server, pix, z1=0.1234567, z2=1000.5)[0] > 0
+    assert (server.frames[_d.frame] == expect).all()
+
+    # and so is a frame invalidated by the caller
+    _d.invalidate(_d.frame)
+    assert _displays(server, pix, z1=0.1234567, z2=1000.5)[0] > 0
+
+def test_resident_reformatted(server):
+    # ds9 and ximtool write the WCS back with %g; the frame is still
+    # recognized as holding the image.
+    srv = iisserver.IISServer(wcsformat='%g').start()
+    try:
+        numdisplay.open(srv.imtdev)
+        rng = n.random.RandomState(13)
+        pix = rng.rand(300, 300) * 1000
+        _d = show(pix, bufname='imt512', z1=0.1234567, z2=1000.5)
+        assert srv.wcs[_d.frame].split()[-3:] == ['0.123457', '1000.5', '1']
+        assert _displays(srv, pix, z1=0.1234567, z2=1000.5)[0] == 0
+    finally:
+        numdisplay.close()
+        srv.stop()
+        numdisplay.open(server.imtdev)
+
+def test_shadow_off():
+    # Frames are not shadowed unless asked for
+    assert not displaydev.ImageDisplay.shadowframes
+
+@pytest.mark.parametrize('shadow', [False, True])
+def test_delta_update(server, monkeypatch, shadow):
+    monkeypatch.setattr(displaydev.ImageDisplay, 'shadowframes', shadow)
+    device().invalidate()
+    rng = n.random.RandomState(14)
+    pix = rng.rand(512, 512) * 1000
+    _d = show(pix, bufname='imt512', z1=0, z2=1000)
+    assert (_d._resident[_d.frame][3] is not None) == shadow
+
+    # With a shadow, only the run of changed rows is sent again; without,
+    # the whole image (32 rows per packet)
+    pix[100:103] = 5.
+    m0 = server.packets['memory']
+    show(pix, bufname='imt512', z1=0, z2=1000)
+    assert server.packets['memory'] - m0 == (1 if shadow else 16)
+    assert (server.frames[_d.frame] == expected(pix, 0, 1000, 512, 512)).all()
+
+    # and nothing at all for an identical image
+    m0 = server.packets['memory']
+    show(pix, bufname='imt512', z1=0, z2=1000)
+    assert server.packets['memory'] == m0
+    device().invalidate()
+
+@pytest.mark.parametrize('blocksize', [None, 100, 3000])
+def test_read_region(server, blocksize):
+    rng = n.random.RandomState(16)
+    pix = rng.rand(300, 400) * 1000
+    _d = show(pix, bufname='imt512', z1=0, z2=1000)
+    frame = server.frames[_d.frame][::-1]
+
+    # Full width regions are read many rows per request, narrower ones a
+    # row (or a row segment) per request
+    assert (_d.readRegion(0, 10, 512, 70, blocksize) == frame[10:80]).all()
+    assert (_d.readRegion(100, 200, 300, 50, blocksize) ==
+            frame[200:250, 100:400]).all()
+    assert (_d.readRegion(511, 511, 1, 1, blocksize) == frame[511:, 511:]).all()
+    with pytest.raises(ValueError):
+        _d.readRegion(500, 0, 100, 10)
+
+def test_read_frame(server, monkeypatch):
+    # Reading the whole frame makes it known to the shadow
+    monkeypatch.setattr(displaydev.ImageDisplay, 'shadowframes', True)
+    rng = n.random.RandomState(17)
+    pix = rng.rand(300, 400) * 1000
+    _d = show(pix, bufname='imt512', z1=0, z2=1000)
+    _d.invalidate()
+    assert (_d.readFrame() == server.frames[_d.frame][::-1]).all()
+    assert _d.shadowValue(5, 7) == server.frames[_d.frame][7, 5]
+    _d.invalidate()
@@ -0,0 +1,96 @@
+"""Tests of the in-process IIS server, driven through numdisplay and
+overlay as a real display would be."""
+from __future__ import absolute_import, division # confidence high
+
+import os, shutil, tempfile
+
+import numpy as n
+import pytest
+
+import stsci.numdisplay as numdisplay
+from stsci.numdisplay import displaydev, iisserver, overlay
+from .iisutil import device, expected, show
+
+
+@pytest.mark.parametrize('dtype', ['uint16', '>i2', 'float32', 'float64'])
+@pytest.mark.parametrize('shape', [(512, 512), (200, 300)])
+def test_frame_contents(server, dtype, shape):
+    rng = n.random.RandomState(1)
+    pix = (rng.rand(*shape) * 3000).astype(dtype)
+    _d = show(pix, bufname='imt512', z1=500, z2=2500)
+    assert (server.frames[_d.frame] ==
+            expected(pix, 500, 2500, 512, 512)).all()
+    assert server.fbconfig[_d.frame] == _d.fbconfig
+
+def test_wcs(server):
+    _d = show(n.ones((100, 200)), bufname='imt512', z1=0, z2=2, name='test')
+    _wcs = server.wcs[_d.frame].split('\n')
+    assert _wcs[0] == 'test'
+    assert _wcs[1].split()[-3:] == ['0', '2', '1']
+    # The WCS is read back as written
+    _wcsinfo = _d.readWCS(displaydev.ImageWCS(n.zeros((1, 1))))
+    assert _wcsinfo.name == 'test'
+
+def test_frames(server):
+    pix = n.arange(512 * 512.).reshape(512, 512) % 100
+    _d = show(pix, bufname='imt512', z1=0, z2=100, frame=2)
+    assert server.frame == 2
+    assert (server.frames[2] == expected(pix, 0, 100, 512, 512)).all()
+    _d.eraseFrame()
+    _d.readInfo()
+    assert not server.frames[2].any()
+
+def test_cursor(server):
+    server.cursor = (12.5, 30.25, 'x')
+    _x, _y, _frame, _key = numdisplay.readcursor(sample=1).split()
+    assert (float(_x), float(_y), _key) == (12.5, 30.25, 'x')
+
+def test_readback(server):
+    pix = n.arange(300 * 400.).reshape(300, 400) % 1000
+    _d = show(pix, bufname='imt512', z1=0, z2=1000)
+    buf = n.zeros(10, dtype=n.uint8)
+    _row = server.frames[_d.frame][50]
+    assert (n.frombuffer(_d.readData(20, 50, buf), dtype=n.uint8) ==
+            _row[20:30]).all()
+
+@pytest.mark.parametrize('transport', ['unix', 'inet', 'fifo'])
+def test_transports(server, transport):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        if transport == 'unix':
+            imtdev = 'unix:' + os.path.join(tmpdir, '.IMT%d')
+        elif transport == 'inet':
+            imtdev = 'inet:0'
+        else:
+            imtdev = 'fifo:%s:%s' % (os.path.join(tmpdir, 'imt1i'),
+                                     os.path.join(tmpdir, 'imt1o'))
+        srv = iisserver.IISServer(imtdev).start()
+        try:
+            numdisplay.open(srv.imtdev)
+            pix = n.arange(512 * 512.).reshape(512, 512) % 251
+            _d = show(pix, bufname='imt512', z1=0, z2=250)
+            assert (srv.frames[_d.frame] ==
+                    expected(pix, 0, 250, 512, 512)).all()
+            assert srv.packets['memory'] > 0 and srv.packets['wcs'] > 0
+        finally:
+            numdisplay.close()
+            srv.stop()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        numdisplay.open(server.imtdev)
+
+def test_overlay_undo(server):
+    rng = n.random.RandomState(4)
+    pix = rng.rand(512, 512) * 1000
+    _d = show(pix, bufname='imt512', z1=0, z2=1000)
+    before = server.frames[_d.frame].copy()
+
+    overlay.circle(x=200, y=300, radius=40, color=overlay.C_RED)
+    device().readInfo()
+    drawn = server.frames[_d.frame] != before
+    assert drawn.any()
+    assert (server.frames[_d.frame][drawn] == overlay.C_RED).all()
+
+    overlay.undo()
+    device().readInfo()
+    assert (server.frames[_d.frame] == before).all()
@@ -0,0 +1,141 @@
+"""Tests of the memory mapped image files of the imfile module."""
+from __future__ import absolute_import, division # confidence high
+
+import numpy as n
+import pytest
+
+from stsci.numdisplay import imfile
+
+from .iisutil import expected, show
+
+
+def _card(key, value=None, comment=None):
+    if value is None:
+        return key.ljust(80)
+    if isinstance(value, bool):
+        value = 'T' if value else 'F'
+    elif isinstance(value, str):
+        value = "'%s'" % value.replace("'", "''").ljust(8)
+    card = '%-8s= %20s' % (key, value)
+    if comment:
+        card += ' / ' + comment
+    return card.ljust(80)
+
+def _hdu(cards, data=None):
+    """ Bytes of a FITS HDU with the given cards and (big endian) data."""
+    header = ''.join(cards) + _card('END')
+    header = header.ljust(-(-len(header) // 2880) * 2880)
+    out = header.encode('ascii')
+    if data is not None:
+        raw = data.tobytes()
+        out += raw + b'\0' * (-len(raw) % 2880)
+    return out
+
+def _write(path, *hdus):
+    with open(str(path), 'wb') as f:
+        for hdu in hdus:
+            f.write(hdu)
+    return str(path)
+
+def _primary(naxes=(), bitpix=8):
+    cards = [_card('SIMPLE', True), _card('BITPIX', bitpix),
+             _card('NAXIS', len(naxes))]
+    cards += [_card('NAXIS%d' % (i + 1), v) for i, v in enumerate(naxes)]
+    return cards
+
+def _image(data, bitpix, extname, **keys):
+    ny, nx = data.shape
+    cards = [_card('XTENSION', 'IMAGE', 'image extension'),
+             _card('BITPIX', bitpix), _card('NAXIS', 2),
+             _card('NAXIS1', nx), _card('NAXIS2', ny),
+             _card('PCOUNT', 0), _card('GCOUNT', 1),
+             _card('EXTNAME', extname)]
+    cards += [_card(k, v) for k, v in keys.items()]
+    return _hdu(cards, data)
+
+
+def test_fits_headers(tmp_path):
+    data = n.arange(12, dtype='>f4').reshape(3, 4)
+    cards = _primary() + [_card('OBJECT', "M31 'core'", 'a comment'),
+                          _card('COMMENT'),
+                          ('%-8s= %20s' % ('EXPTIME', '1.5D2')).ljust(80),
+                          _card('FLAG', False)]
+    name = _write(tmp_path / 'a.fits', _hdu(cards),
+                  _image(data, -32, 'SCI'))
+    hdus = imfile.readFitsHeaders(name)
+    assert len(hdus) == 2
+    header, offset = hdus[0]
+    assert header['OBJECT'] == "M31 'core'"
+    assert header['EXPTIME'] == 150.
+    assert header['FLAG'] is False
+    assert offset == 2880
+    header, offset = hdus[1]
+    assert header['EXTNAME'] == 'SCI' and header['NAXIS1'] == 4
+    assert offset == 2 * 2880
+
+    # The first 2-d image, or the one selected by number or name
+    for ext in (None, 1, 'SCI'):
+        pix = imfile.openImage(name, ext=ext)
+        assert isinstance(pix, n.memmap) and (pix == data).all()
+    with pytest.raises(ValueError):
+        imfile.openImage(name, ext=0)
+
+def test_not_fits(tmp_path):
+    name = str(tmp_path / 'a.dat')
+    with open(name, 'wb') as f:
+        f.write(b'\0' * 4000)
+    with pytest.raises(ValueError):
+        imfile.readFitsHeaders(name)
+
+def test_scaled_image(tmp_path):
+    data = n.arange(-6, 6, dtype='>i2').reshape(3, 4)
+    name = _write(tmp_path / 'a.fits', _hdu(_primary()),
+                  _image(data, 16, 'SCI', BSCALE=0.5, BZERO=10.))
+    pix = imfile.openImage(name)
+    assert isinstance(pix, imfile.ScaledImage) and imfile.isLazyImage(pix)
+    assert pix.dtype == n.float64 and pix.shape == (3, 4)
+    assert (pix[1:, 2:] == data[1:, 2:] * 0.5 + 10.).all()
+    assert (n.asarray(pix) == data * 0.5 + 10.).all()
+
+@pytest.mark.parametrize('bitpix,signed,unsigned', [(16, '>i2', 'u2'),
+                                                    (32, '>i4', 'u4'),
+                                                    (8, 'u1', 'i1')])
+def test_unsigned_convention(tmp_path, bitpix, signed, unsigned):
+    # BZERO = 2**(BITPIX-1) (or -2**7 for bytes) gives the other signedness
+    # of the same size, with no float conversion
+    values = n.array([n.iinfo(unsigned).min, 0, 1, n.iinfo(unsigned).max],
+                     dtype=unsigned).reshape(2, 2)
+    bzero = -int(n.iinfo(signed).min) if bitpix > 8 else -128
+    raw = (values.astype(n.int64) - bzero).astype(signed)
+    name = _write(tmp_path / 'a.fits', _hdu(_primary()),
+                  _image(raw, bitpix, 'SCI', BZERO=bzero))
+    pix = imfile.openImage(name)
+    assert pix.dtype == n.dtype(unsigned)
+    assert pix[...].dtype == n.dtype(unsigned)
+    assert (pix[...] == values).all()
+    assert (pix[1] == values[1]).all()
+
+def test_npy_and_raw(tmp_path):
+    data = n.arange(20, dtype=n.int32).reshape(4, 5)
+    name = str(tmp_path / 'a.npy')
+    n.save(name, data)
+    pix = imfile.openImage(name)
+    assert isinstance(pix, n.memmap) and (pix == data).all()
+
+    name = str(tmp_path / 'a.raw')
+    with open(name, 'wb') as f:
+        f.write(b'\0' * 16 + data.astype('>i4').tobytes())
+    pix = imfile.openImage(name, shape=(4, 5), dtype='>i4', offset=16)
+    assert (pix == data).all()
+    with pytest.raises(ValueError):
+        imfile.openImage(name, shape=(4, 5))
+
+def test_display_file(server, tmp_path):
+    rng = n.random.RandomState(6)
+    data = (rng.rand(300, 400) * 1000).astype('>i2')
+    name = _write(tmp_path / 'a.fits', _hdu(_primary()),
+                  _image(data, 16, 'SCI', BZERO=32768))
+    _d = show(name, bufname='imt512', z1=0, z2=32768 + 1000)
+    assert (server.frames[_d.frame] ==
+            expected(data.astype(n.int64) + 32768, 0, 32768 + 1000,
+                     512, 512)).all()
@@ -0,0 +1,251 @@
+"""Tests of the pixel scaling and the input conversion of
+numdisplay.NumDisplay."""
+from __future__ import absolute_import, division # confidence high
+
+import gc, weakref
+
+import numpy as n
+import pytest
+
+import stsci.numdisplay as numdisplay
+
+from .iisutil import expected, show
+
+
+def _identity(pix):
+    return pix
+
+def _sqrt(pix):
+    return n.sqrt(n.abs(pix))
+
+def _log(pix):
+    return n.log1p(n.abs(pix))
+
+
+@pytest.mark.parametrize('dtype', ['uint8', 'int8', 'uint16', 'int16', '>i2',
+                                   '>u2'])
+@pytest.mark.parametrize('transform,offset,scale', [(_identity, None, None),
+                                                    (_sqrt, 10, 2.),
+                                                    (_log, None, 0.5)])
+def test_lookup_table(dtype, transform, offset, scale):
+    # Every value of the type is mapped by the table exactly as the
+    # per-pixel scaling maps it.
+    dtype = n.dtype(dtype)
+    info = n.iinfo(dtype)
+    values = n.arange(info.min, info.max + 1).astype(dtype)
+    values = values.reshape(-1, 1 << (4 * dtype.itemsize))
+    nd = numdisplay.NumDisplay()
+    if transform is _identity:
+        z1, z2 = info.min + 3, info.max // 2
+    else:
+        z1, z2 = 0, transform((info.max // 2 + (offset or 0)) * (scale or 1))
+    nd.set(z1=z1, z2=z2, transform=transform, offset=offset, scale=scale)
+    # The offset may wrap the smaller types around, in both cases alike
+    with n.errstate(all='ignore'):
+        perpixel = nd._scaleImage(values).copy()
+        table = nd._applyLookupTable(nd._lookupTable(dtype), values).copy()
+    assert (table == perpixel).all()
+
+@pytest.mark.filterwarnings('ignore::PendingDeprecationWarning')
+def test_matrix_input(server):
+    # ndarray subclasses are displayed as plain arrays, with a range and a
+    # WCS the server can parse.
+    pix = n.arange(512 * 512.).reshape(512, 512) % 997
+    _d = show(n.matrix(pix), bufname='imt512')
+    assert (server.frames[_d.frame] == expected(pix, 0, 996, 512, 512)).all()
+    assert [float(v) for v in server.wcs[_d.frame].split()[-3:]] == [0, 996, 1]
+
+class _LazyImage(object):
+    """ An array-like image which records the number of pixels of each
+    slice read from it, and cannot be converted as a whole."""
+
+    def __init__(self, pix):
+        self._pix = pix
+        self.shape = pix.shape
+        self.dtype = pix.dtype
+        self.reads = []
+
+    def __getitem__(self, key):
+        _sec = self._pix[key]
+        self.reads.append(n.size(_sec))
+        return _sec
+
+    def __array__(self, dtype=None, copy=None):
+        raise AssertionError("lazy image converted to an array")
+
+@pytest.mark.parametrize('kwargs', [dict(z1=0, z2=1000), dict(),
+                                    dict(zscale=True), dict(fit='bin')])
+def test_lazy_input(server, kwargs):
+    # Lazy images are only ever sliced, and only the section which fits in
+    # the frame buffer is read in full.
+    rng = n.random.RandomState(7)
+    pix = rng.rand(1500, 1200) * 1000
+    lazy = _LazyImage(pix)
+    _d = show(lazy, bufname='imt512', **kwargs)
+    assert lazy.reads and max(lazy.reads) <= 512 * 512
+    if not kwargs.get('fit'):
+        assert sum(lazy.reads) < pix.size // 4
+        section = pix[494:1006, 344:856]
+        z1, z2 = kwargs.get('z1'), kwargs.get('z2')
+        if not kwargs:
+            z1, z2 = section.min(), section.max()
+        if z1 is not None:
+            assert (server.frames[_d.frame] ==
+                    expected(section, z1, z2, 512, 512)).all()
+
+@pytest.mark.parametrize('shape,binning,factor,origin', [
+                         ((1500, 1200), 'mean', 3, 1.),
+                         ((1501, 1202), 'sample', 3, 1),
+                         ((1024, 700), 'mean', 2, 0.5),
+                         ((1024, 700), 'sample', 2, 1)])
+def test_bin_wcs(server, shape, binning, factor, origin):
+    # Each frame buffer pixel shows a block of factor x factor image
+    # pixels, and the WCS maps it onto the center of the mean (or onto the
+    # sampled pixel) of that block, in pixels of the full image.
+    rng = n.random.RandomState(8)
+    pix = rng.rand(*shape) * 1000
+    _d = show(pix, bufname='imt512', z1=0, z2=1000, fit='bin',
+              binning=binning)
+    ny, nx = shape[0] // factor, shape[1] // factor
+    blocks = pix[:ny * factor, :nx * factor].reshape(ny, factor, nx, factor)
+    if binning == 'mean':
+        binned = blocks.mean(axis=3).mean(axis=1)
+    else:
+        binned = blocks[:, factor // 2, :, factor // 2]
+    assert (server.frames[_d.frame] ==
+            expected(binned, 0, 1000, 512, 512)).all()
+
+    a, b, c, d, tx, ty = [float(v) for v in
+                          server.wcs[_d.frame].split('\n')[1].split()[:6]]
+    assert (a, b, c, d) == (factor, 0, 0, -factor)
+    # Frame buffer column (row from the top) of the first column (last row)
+    lx = 256 - nx // 2
+    ly = 512 - int(512 + ny / 2. - 256 + 0.5)
+    for col in (lx, lx + nx // 2, lx + nx - 1):
+        assert a * col + tx == (col - lx) * factor + origin + 1
+    for row in (ly, ly + ny // 2, ly + ny - 1):
+        assert d * row + ty == (ny - 1 - (row - ly)) * factor + origin + 1
+
+def _scaled(pix, z1, z2):
+    return n.clip((pix - z1) * (199. / (z2 - z1)) + 1., 1., 200.).astype(n.uint8)
+
+def _frameview(scaled, cx, cy):
+    """ Frame buffer showing the scaled pixels of a 512x512 view centered
+    on their pixel (cx, cy), 0-based."""
+    out = n.zeros((512, 512), dtype=n.uint8)
+    x0, y0 = cx - 256, cy - 256
+    ny, nx = scaled.shape
+    sx0, sy0 = max(x0, 0), max(y0, 0)
+    sx1, sy1 = min(x0 + 512, nx), min(y0 + 512, ny)
+    out[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = scaled[sy0:sy1, sx0:sx1]
+    return out[::-1]
+
+def _block(server, frame):
+    return float(server.wcs[frame].split('\n')[1].split()[0])
+
+def test_pan_zoom(server):
+    rng = n.random.RandomState(10)
+    pix = rng.rand(1500, 1200) * 1000
+    _d = show(pix, bufname='imt512', z1=0, z2=1000, fit='bin')
+    binned = pix.reshape(500, 3, 400, 3).mean(axis=3).mean(axis=1)
+
+    # Panning to the center of the image shows the same view again
+    before = server.frames[_d.frame].copy()
+    numdisplay.pan(600.5, 750.5)
+    _d.readInfo()
+    assert (server.frames[_d.frame] == before).all()
+    # and panning there once more sends nothing
+    m0 = server.packets['memory']
+    numdisplay.pan(600.5, 750.5)
+    _d.readInfo()
+    assert server.packets['memory'] == m0
+
+    # pan keeps the block factor the image was displayed with, binning
+    # before scaling just as display does
+    numdisplay.pan(301, 902)
+    _d.readInfo()
+    assert _block(server, _d.frame) == 3
+    assert (server.frames[_d.frame] ==
+            _frameview(_scaled(binned, 0, 1000), 100, 300)).all()
+
+    # zoom(0) shows the full resolution image, around the same center
+    numdisplay.zoom(0)
+    _d.readInfo()
+    assert _block(server, _d.frame) == 1
+    assert (server.frames[_d.frame] ==
+            _frameview(_scaled(pix, 0, 1000), 300, 901)).all()
+
+    # and zoom(1) the mean of 2x2 blocks of scaled pixels
+    numdisplay.zoom(1, 601, 751)
+    _d.readInfo()
+    s = _scaled(pix, 0, 1000).astype(n.uint16)
+    level = (s[0::2, 0::2] + s[1::2, 0::2] + s[0::2, 1::2] + s[1::2, 1::2]
+             + 2) // 4
+    assert _block(server, _d.frame) == 2
+    assert (server.frames[_d.frame] ==
+            _frameview(level.astype(n.uint8), 300, 375)).all()
+    numdisplay.pan(601, 751)
+    _d.readInfo()
+    assert _block(server, _d.frame) == 2
+
+    with pytest.raises(ValueError):
+        numdisplay.zoom(5)
+
+def test_release(server):
+    # The displayed array is kept for pan and zoom until release()
+    pix = n.arange(600 * 700.).reshape(600, 700) % 1000
+    ref = weakref.ref(pix)
+    show(pix, bufname='imt512', z1=0, z2=1000)
+    del pix
+    gc.collect()
+    assert ref() is not None
+    numdisplay.pan(100, 100)
+    numdisplay.release()
+    gc.collect()
+    assert ref() is None
+    with pytest.raises(ValueError):
+        numdisplay.pan(100, 100)
+
+def test_cache(server, monkeypatch):
+    # With cache=True, the same array displayed with the same settings is
+    # not scaled again; any other array or setting is.
+    scaled = []
+    fbclip = numdisplay.view._fbclipImage
+    def _fbclipImage(pix, *args, **kwargs):
+        scaled.append(pix.shape)
+        return fbclip(pix, *args, **kwargs)
+    monkeypatch.setattr(numdisplay.view, '_fbclipImage', _fbclipImage)
+    monkeypatch.setattr(numdisplay.view, 'cachesize', 2)
+
+    rng = n.random.RandomState(11)
+    a = rng.rand(512, 512) * 1000
+    b = rng.rand(512, 512) * 1000
+    show(a, bufname='imt512', z1=0, z2=1000, cache=True)
+    _d = show(a, bufname='imt512', z1=0, z2=1000, cache=True)
+    assert len(scaled) == 1
+    assert (server.frames[_d.frame] == expected(a, 0, 1000, 512, 512)).all()
+
+    show(a, bufname='imt512', z1=0, z2=500, cache=True)
+    assert len(scaled) == 2
+    show(b, bufname='imt512', z1=0, z2=1000, cache=True)
+    assert len(scaled) == 3
+    # b and (a, z2=500) are the 2 most recently used
+    _d = show(b, bufname='imt512', z1=0, z2=1000, cache=True)
+    assert len(scaled) == 3
+    assert (server.frames[_d.frame] == expected(b, 0, 1000, 512, 512)).all()
+    show(a, bufname='imt512', z1=0, z2=1000, cache=True)
+    assert len(scaled) == 4
+
+    # Without cache=True, nothing is looked up
+    show(a, bufname='imt512', z1=0, z2=1000)
+    assert len(scaled) == 5
+    numdisplay.view._cache.clear()
+
+def test_changed_in_place(server):
+    # By default, pixels changed in place (off the grid the cache samples)
+    # are displayed
+    pix = n.arange(512 * 512.).reshape(512, 512) % 1000
+    show(pix, bufname='imt512', z1=0, z2=1000)
+    pix[101:103, 3:5] = 999.
+    _d = show(pix, bufname='imt512', z1=0, z2=1000)
+    assert (server.frames[_d.frame] == expected(pix, 0, 1000, 512, 512)).all()
@@ -0,0 +1,42 @@
+"""Tests of the overlay graphics, against the in-process IIS server."""
+from __future__ import absolute_import, division # confidence high
+
+import numpy as n
+import pytest
+
+from stsci.numdisplay import displaydev, overlay
+
+from .iisutil import device, show
+
+
+@pytest.mark.parametrize('shadow', [False, True])
+def test_undo_values(server, monkeypatch, shadow):
+    # The values restored by undo come from the shadow of the frame when
+    # there is one, and are read back from the display otherwise.
+    monkeypatch.setattr(displaydev.ImageDisplay, 'shadowframes', shadow)
+    device().invalidate()
+    rng = n.random.RandomState(15)
+    pix = rng.rand(512, 512) * 1000
+    _d = show(pix, bufname='imt512', z1=0, z2=1000)
+    before = server.frames[_d.frame].copy()
+
+    reads = []
+    readData = _d.readData
+    def _readData(*args):
+        reads.append(args[:2])
+        return readData(*args)
+    monkeypatch.setattr(_d, 'readData', _readData)
+
+    overlay.rectangle(left=10, right=400, lower=20, upper=350,
+                      color=overlay.C_GREEN)
+    overlay.polyline(points=[(50, 50), (100, 80), (60, 200)],
+                     color=overlay.C_BLUE)
+    _d.readInfo()
+    assert (server.frames[_d.frame] != before).any()
+    assert (len(reads) == 0) == shadow
+
+    overlay.undo()
+    overlay.undo()
+    _d.readInfo()
+    assert (server.frames[_d.frame] == before).all()
+    device().invalidate()
@@ -0,0 +1,47 @@
+"""Tests of the tiles of the pyramid module."""
+from __future__ import absolute_import, division # confidence high
+
+import numpy as n
+
+from stsci.numdisplay import pyramid
+
+
+def _pyramid(image, tilesize=64):
+    calls = []
+    def _scale(y0, y1, x0, x1):
+        calls.append((y0, y1, x0, x1))
+        return image[y0:y1, x0:x1]
+    return pyramid.ImagePyramid(image.shape, _scale, tilesize), calls
+
+def test_levels():
+    rng = n.random.RandomState(9)
+    image = rng.randint(0, 256, (301, 250)).astype(n.uint8)
+    pyr, calls = _pyramid(image)
+    assert pyr.nlevels == 4 and pyr.levelshape(3) == (37, 31)
+
+    # Pixels outside the image are 0
+    region = pyr.region(0, -10, -20, 100, 100)
+    assert (region[10:, 20:] == image[:100, :100]).all()
+    assert (region[:10] == 0).all() and (region[:, :20] == 0).all()
+
+    # Each level is the rounded mean of 2x2 blocks of the one below
+    level = image
+    for k in range(1, pyr.nlevels):
+        ny, nx = pyr.levelshape(k)
+        blocks = level[:2 * ny, :2 * nx].astype(n.uint16)
+        level = ((blocks[0::2, 0::2] + blocks[1::2, 0::2] +
+                  blocks[0::2, 1::2] + blocks[1::2, 1::2] + 2) // 4)
+        level = level.astype(n.uint8)
+        assert (pyr.region(k, 0, 0, ny, nx) == level).all()
+
+def test_tiles_scaled_once():
+    image = n.arange(200 * 200).reshape(200, 200).astype(n.uint8)
+    pyr, calls = _pyramid(image)
+    pyr.region(2, 0, 0, 50, 50)
+    pyr.region(0, 30, 30, 150, 150)
+    pyr.region(1, 0, 0, 100, 100)
+    assert sorted(calls) == sorted(set(calls))
+    assert len(calls) == 16
+    pyr.clear()
+    pyr.region(0, 0, 0, 10, 10)
+    assert len(calls) == 17
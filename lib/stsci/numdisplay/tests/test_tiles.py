@@ -0,0 +1,35 @@
+"""Tests of the row tiles and the tiled min/max of the tiles module."""
+from __future__ import absolute_import, division # confidence high
+
+import numpy as n
+import pytest
+
+from stsci.numdisplay import tiles
+
+
+def test_rowtiles():
+    _tiles = tiles.rowtiles((1000, 300), npix=3000)
+    assert _tiles[0][0] == 0 and _tiles[-1][1] == 1000
+    assert all(t0[1] == t1[0] for t0, t1 in zip(_tiles[:-1], _tiles[1:]))
+    assert all(t[1] - t[0] == 10 for t in _tiles)
+
+@pytest.mark.parametrize('shape,nthreads', [((300, 400), 1),
+                                            ((2048, 2048), 2)])
+def test_minmax_nan(shape, nthreads):
+    # NaNs are ignored, in the first and last tiles as anywhere else, and
+    # in the threaded pass over large images as well.
+    rng = n.random.RandomState(5)
+    pix = rng.rand(*shape).astype(n.float32)
+    pix[0, 0] = pix[-1, -1] = n.nan
+    pix[shape[0] // 2] = n.nan
+    pix[7, 11] = -3.
+    pix[-7, -11] = 4.
+    assert tiles.minmax(pix, nthreads) == (-3., 4.)
+
+def test_minmax_all_nan():
+    zmin, zmax = tiles.minmax(n.full((10, 10), n.nan))
+    assert n.isnan(zmin) and n.isnan(zmax)
+
+def test_minmax_integer():
+    pix = n.arange(-5, 95, dtype=n.int16).reshape(10, 10)
+    assert tiles.minmax(pix) == (-5, 94)
@@ -0,0 +1,97 @@
+"""tiles.py: Row tiles of large images and a shared thread pool
+
+NumPy releases the GIL inside its ufunc loops, so work on a large image
+can be spread over several threads by splitting it into bands of whole
+rows (tiles) and handing each tile to a thread of a shared pool.
+
+    rowtiles(shape, npix=TILE_PIXELS)::
+        Return the (start, end) rows of the tiles covering an image.
+
+    getpool(nthreads=None)::
+        Return the shared thread pool for nthreads threads, or None when
+        a single thread should be used.
+
+    maptiles(func, tiles, nthreads=None, npix=0)::
+        Apply func to each tile, in the thread pool for large images.
+
+    minmax(pix, nthreads=None)::
+        Return the minimum and maximum of an array, ignoring NaNs, in a
+        single tiled (and possibly threaded) pass.
+
+"""
+from __future__ import absolute_import, division # confidence high
+
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+import numpy as n
+
+# Number of pixels in each tile: small enough that both reductions of
+# minmax find the tile in cache.
+TILE_PIXELS = 131072
+
+# Images with fewer pixels than this are always processed in one thread.
+MIN_THREADED_PIXELS = 1 << 22
+
+_pools = {}
+
+def ncpus():
+    """ Number of CPUs available, used as the default number of threads."""
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+def getpool(nthreads=None):
+    """ Return the shared ThreadPool with nthreads threads (default: one per
+    CPU), or None if only one thread is to be used."""
+
+    if nthreads is None:
+        nthreads = ncpus()
+    if nthreads <= 1:
+        return None
+    if nthreads not in _pools:
+        _pools[nthreads] = ThreadPool(nthreads)
+    return _pools[nthreads]
+
+def rowtiles(shape, npix=TILE_PIXELS):
+    """ Return a list of (start, end) rows of tiles of about npix pixels
+    covering an image of the given shape."""
+
+    _ny = shape[0]
+    _rowsize = max(1, int(n.prod(shape[1:])))
+    _nlines = max(1, min(_ny, npix // _rowsize))
+    return [(y0, min(y0 + _nlines, _ny)) for y0 in range(0, _ny, _nlines)]
+
+def maptiles(func, tiles, nthreads=None, npix=0):
+    """ Apply func to each of the tiles, in the shared thread pool when the
+    image being processed (of npix pixels) is large enough; returns the
+    list of results."""
+
+    pool = None
+    if npix >= MIN_THREADED_PIXELS and len(tiles) > 1:
+        pool = getpool(nthreads)
+    if pool is None:
+        return [func(tile) for tile in tiles]
+    return pool.map(func, tiles)
+
+def minmax(pix, nthreads=None):
+    """ Return (min, max) of the array pix, ignoring NaN values.
+
+    Both reductions are made on each tile in turn while it is in cache,
+    so the array is only read from memory once, and large arrays are
+    spread over nthreads threads.  If all values are NaN, NaN is returned.
+    """
+
+    pix = n.asarray(pix)
+    if pix.ndim == 0 or pix.size == 0:
+        return n.fmin.reduce(pix.ravel()), n.fmax.reduce(pix.ravel())
+
+    def _tileminmax(tile):
+        _sec = pix[tile[0]:tile[1]]
+        return n.fmin.reduce(_sec, axis=None), n.fmax.reduce(_sec, axis=None)
+
+    results = maptiles(_tileminmax, rowtiles(pix.shape), nthreads, pix.size)
+    _mins = n.array([r[0] for r in results])
+    _maxs = n.array([r[1] for r in results])
+    return n.fmin.reduce(_mins), n.fmax.reduce(_maxs)
@@ -1,16 +1,29 @@
 from __future__ import division # confidence high
 
 import math
+import multiprocessing
 import numpy
 
+from . import tiles
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
 MAX_REJECT = 0.5
 MIN_NPIXELS = 5
 GOOD_PIXEL = 0
 BAD_PIXEL = 1
 KREJ = 2.5
 MAX_ITERATIONS = 5
+# 8 and 16 bit integer images are scaled from a histogram of their values,
+# rather than from their sorted values, when there are at least that many
+# samples (or when the whole image is used)
+HISTOGRAM_NPIX = 65536
 
-def zscale (image, nsamples=1000, contrast=0.25, bpmask=None, zmask=None):
+def zscale (image, nsamples=1000, contrast=0.25, bpmask=None, zmask=None,
+            samples=None, full=False, nthreads=None):
     """Implement IRAF zscale algorithm
 
     Parameters
@@ -31,15 +44,44 @@ def zscale (image, nsamples=1000, contrast=0.25, bpmask=None, zmask=None):
     zmask : None
         Not used at this time
 
+    samples : arr (Default: None)
+        Sorted samples of the image, as returned by zsc_sorted_sample; when
+        given, the image is neither sampled nor sorted again
+
+    full : bool (Default: False)
+        Use all the pixels of the image rather than nsamples of them
+
+    nthreads : int (Default: None)
+        Number of threads counting the histogram of a large image (default:
+        one per CPU)
+
     Returns
     -------
     (z1, z2)
+
+    The pixels of 8 and 16 bit integer images are counted in a histogram
+    instead of being sorted, when the whole image is used or nsamples is
+    at least HISTOGRAM_NPIX.  The line is then fitted to the runs of equal
+    values of the sorted pixels, so scaling from the whole image costs
+    little more than reading it.
     """
 
     # Sample the image
-    samples = zsc_sample (image, nsamples, bpmask, zmask)
+    if samples is None and zsc_histogram_dtype (image.dtype) and \
+            (full or nsamples >= HISTOGRAM_NPIX):
+        if full:
+            values, counts = zsc_histogram (image, nthreads)
+        else:
+            values, counts = zsc_histogram (zsc_sample (image, nsamples),
+                                            nthreads)
+        return zscale_histogram (values, counts, contrast)
+    if samples is None:
+        if full:
+            samples = numpy.array(image).ravel()
+            samples.sort()
+        else:
+            samples = zsc_sorted_sample (image, nsamples, bpmask, zmask)
     npix = len(samples)
-    samples.sort()
     zmin = samples[0]
     zmax = samples[-1]
     # For a zero-indexed array
@@ -65,6 +107,377 @@ def zscale (image, nsamples=1000, contrast=0.25, bpmask=None, zmask=None):
         z2 = min (zmax, median + (npix - center_pixel) * zslope)
     return z1, z2
 
+def zscale_batch (cube, axis=0, nsamples=1000, contrast=0.25):
+    """Implement IRAF zscale algorithm for each plane of a cube at once
+
+    Parameters
+    ----------
+    cube : arr
+        3-d numpy array (or array-like image, which is only sliced), such
+        as the planes of a data cube or the amplifiers of a mosaic
+
+    axis : int (Default: 0)
+        Axis of the cube along which the planes are stacked
+
+    nsamples : int (Default: 1000)
+        Number of points in each plane to sample
+
+    contrast : float (Default: 0.25)
+        Scaling factor for determining min and max
+
+    Returns
+    -------
+    (z1, z2), two arrays with the limits of each plane
+
+    All the planes are sampled on the same grid as zscale would use, and
+    their samples are sorted and fitted together, as the rows of 2-d
+    arrays with a rejection mask for each plane.
+    """
+
+    if len(cube.shape) != 3:
+        raise ValueError("zscale_batch needs a 3-d array")
+    axis = axis % 3
+    nplanes = cube.shape[axis]
+    nc, nl = [cube.shape[i] for i in range(3) if i != axis]
+    stride = max (1.0, math.sqrt((nc - 1) * (nl - 1) / float(nsamples)))
+    stride = int (stride)
+    index = [slice(None, None, stride)] * 3
+    index[axis] = slice(None)
+    samples = numpy.asarray(cube[tuple(index)])
+    samples = numpy.moveaxis(samples, axis, 0).reshape(nplanes, -1)
+    samples = samples[:, :nsamples].astype(numpy.float64)
+    samples.sort(axis=1)
+
+    npix = samples.shape[1]
+    zmin = samples[:, 0]
+    zmax = samples[:, -1]
+    # For a zero-indexed array
+    center_pixel = (npix - 1) // 2
+    if npix%2 == 1:
+        median = samples[:, center_pixel]
+    else:
+        median = 0.5 * (samples[:, center_pixel] +
+                        samples[:, center_pixel + 1])
+
+    #
+    # Fit a line to the sorted samples of each plane
+    minpix = max(MIN_NPIXELS, int(npix * MAX_REJECT))
+    ngrow = max (1, int (npix * 0.01))
+    ngoodpix, zstart, zslope = zsc_fit_lines (samples, npix, KREJ, ngrow,
+                                              MAX_ITERATIONS)
+
+    if contrast > 0: zslope = zslope / contrast
+    z1 = numpy.maximum (zmin, median - (center_pixel - 1) * zslope)
+    z2 = numpy.minimum (zmax, median + (npix - center_pixel) * zslope)
+    rejected = ngoodpix < minpix
+    z1[rejected] = zmin[rejected]
+    z2[rejected] = zmax[rejected]
+    return z1, z2
+
+def zscale_parallel (images, nsamples=1000, contrast=0.25, merge=False,
+                     nthreads=None, processes=False):
+    """Implement IRAF zscale algorithm for several images in parallel
+
+    Parameters
+    ----------
+    images : list of arr
+        2-d numpy arrays (or array-like images, which are only sliced),
+        such as the extensions of a multi-chip product or tiles of a
+        large image
+
+    nsamples : int (Default: 1000)
+        Number of points to sample in each image, or in all the images
+        together if merge=True
+
+    contrast : float (Default: 0.25)
+        Scaling factor for determining min and max
+
+    merge : bool (Default: False)
+        If True, the samples of all the images are merged, and a single
+        (z1, z2) is computed from them, so that all the images are
+        displayed with the same scaling
+
+    nthreads : int (Default: None)
+        Number of threads or processes (default: one per CPU)
+
+    processes : bool (Default: False)
+        Use worker processes instead of threads.  The images are sampled
+        in this process, and the workers, started with the 'spawn' method,
+        sort and fit the samples in shared memory, so neither the images
+        nor the samples are pickled.  Where shared memory is not
+        available (before Python 3.8), or with merge=True (where only the
+        sampling is done for each image), threads are used.
+
+    Returns
+    -------
+    list of (z1, z2) of each image, or (z1, z2) if merge=True
+
+    With merge=True, the nsamples samples are shared among the images in
+    proportion to their number of pixels.  The work on each image is done
+    in a single thread, since the threads (or processes) are all busy
+    with the images.
+    """
+
+    images = list(images)
+    if merge:
+        sizes = [int(numpy.prod(image.shape)) for image in images]
+        total = max(1, sum(sizes))
+        counts = [max(1, int(round(nsamples * size / float(total))))
+                  for size in sizes]
+    else:
+        counts = [nsamples] * len(images)
+
+    if nthreads is None:
+        nthreads = tiles.ncpus()
+    nthreads = min(nthreads, len(images))
+
+    if processes and not merge and nthreads > 1 and shared_memory is not None:
+        return _zsc_processes (images, counts, contrast, nthreads)
+
+    threads = tiles.getpool(nthreads)
+    _task = lambda i: _zsc_task (images[i], counts[i], contrast, merge)
+    if threads is None:
+        results = [_task(i) for i in range(len(images))]
+    else:
+        results = threads.map(_task, range(len(images)))
+
+    if not merge:
+        return results
+    return _zsc_limits (numpy.concatenate(results), contrast)
+
+def _zsc_task (image, nsamples, contrast, merge):
+
+    # Work of zscale_parallel on one image, in one thread: its samples if
+    # they are to be merged, or its (z1, z2).
+
+    if merge:
+        return zsc_sample (image, nsamples)
+    return zscale (image, nsamples, contrast, nthreads=1)
+
+def _zsc_limits (samples, contrast, nthreads=None):
+
+    # (z1, z2) of the samples of an image, as zscale finds them from the
+    # image; the samples are sorted in place.
+
+    if zsc_histogram_dtype (samples.dtype) and len(samples) >= HISTOGRAM_NPIX:
+        values, counts = zsc_histogram (samples, nthreads)
+        return zscale_histogram (values, counts, contrast)
+    samples.sort()
+    return zscale (samples, contrast=contrast, samples=samples)
+
+def _zsc_processes (images, nsamples, contrast, nprocs):
+
+    # zscale_parallel of the images in nprocs worker processes.  They are
+    # spawned rather than forked, so that they inherit none of the threads
+    # of this process (such as the thread pools of the tiles module, which
+    # would never run in a forked child).  The images are sampled here,
+    # into one block of shared memory, where each worker sorts and fits
+    # the samples of one image.
+
+    samples = [zsc_sample (image, n) for image, n in zip(images, nsamples)]
+    offsets = []
+    nbytes = 0
+    for s in samples:
+        nbytes = -(-nbytes // 8) * 8
+        offsets.append(nbytes)
+        nbytes += s.nbytes
+
+    shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+    try:
+        tasks = []
+        for s, offset in zip(samples, offsets):
+            numpy.ndarray(s.shape, s.dtype, shm.buf, offset)[...] = s
+            tasks.append((shm.name, offset, s.dtype.str, len(s), contrast))
+        workers = multiprocessing.get_context('spawn').Pool(nprocs)
+        try:
+            return workers.map(_zsc_worker, tasks)
+        finally:
+            workers.close()
+            workers.join()
+    finally:
+        shm.close()
+        shm.unlink()
+
+def _zsc_worker (task):
+
+    # (z1, z2) of the samples of one image of _zsc_processes, in a worker
+    # process
+
+    name, offset, dtype, npix, contrast = task
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        samples = numpy.ndarray((npix,), dtype, shm.buf, offset)
+        z1, z2 = _zsc_limits (samples, contrast, nthreads=1)
+        del samples
+        return z1, z2
+    finally:
+        shm.close()
+
+def zscale_histogram (values, counts, contrast=0.25):
+    """Implement IRAF zscale algorithm from a histogram of the samples
+
+    Parameters
+    ----------
+    values : arr
+        sorted distinct values of the samples
+
+    counts : arr
+        number of samples with each value
+
+    contrast : float (Default: 0.25)
+        Scaling factor for determining min and max
+
+    Returns
+    -------
+    (z1, z2), as zscale would find from the sorted samples
+    """
+
+    counts = numpy.asarray(counts, dtype=numpy.intp)
+    ends = numpy.cumsum(counts)
+    npix = int(ends[-1])
+    zmin = values[0]
+    zmax = values[-1]
+    # For a zero-indexed array
+    center_pixel = (npix - 1) // 2
+    median = values[numpy.searchsorted(ends, center_pixel, 'right')]
+    if npix%2 == 0:
+        upper = values[numpy.searchsorted(ends, center_pixel + 1, 'right')]
+        median = 0.5 * (median + upper)
+
+    #
+    # Fit a line to the sorted samples
+    minpix = max(MIN_NPIXELS, int(npix * MAX_REJECT))
+    ngrow = max (1, int (npix * 0.01))
+    ngoodpix, zstart, zslope = zsc_fit_histogram (values, counts, KREJ, ngrow,
+                                                  MAX_ITERATIONS)
+
+    if ngoodpix < minpix:
+        z1 = zmin
+        z2 = zmax
+    else:
+        if contrast > 0: zslope = zslope / contrast
+        z1 = max (zmin, median - (center_pixel - 1) * zslope)
+        z2 = min (zmax, median + (npix - center_pixel) * zslope)
+    return z1, z2
+
+def zsc_interval (image, method='zscale', nsamples=1000, contrast=0.25,
+                  percentile=99.5, samples=None):
+    """Compute display limits from a sample of the image
+
+    Parameters
+    ----------
+    image : arr
+        2-d numpy array (or array-like image, which is only sliced)
+
+    method : str (Default: 'zscale')
+        'zscale' for the IRAF zscale algorithm, 'minmax' for the minimum
+        and maximum of the samples, or 'percentile' for percentiles of
+        the samples
+
+    nsamples : int (Default: 1000)
+        Number of points in array to sample
+
+    contrast : float (Default: 0.25)
+        Contrast of the zscale method
+
+    percentile : float or (float, float) (Default: 99.5)
+        For the percentile method, either the percentage of the samples
+        kept between z1 and z2 (the same fraction of the samples is cut
+        at both ends), or the (lower, upper) percentiles
+
+    samples : arr (Default: None)
+        Sorted samples of the image, as returned by zsc_sorted_sample, which
+        can be reused for any number of calls
+
+    Returns
+    -------
+    (z1, z2)
+
+    Only zscale needs the samples in order.  Without a sorted sample, the
+    other methods find the few order statistics they need with
+    numpy.partition, in linear time.
+    """
+
+    if method == 'zscale':
+        return zscale (image, nsamples, contrast, samples=samples)
+    if method == 'minmax':
+        fractions = (0., 1.)
+    elif method == 'percentile':
+        if numpy.ndim(percentile) == 0:
+            lower = (100. - percentile) / 2.
+            upper = 100. - lower
+        else:
+            lower, upper = percentile
+        if not 0 <= lower <= upper <= 100:
+            raise ValueError("Percentiles must be within 0 and 100")
+        fractions = (lower / 100., upper / 100.)
+    else:
+        raise ValueError("Unknown interval method `%s'" % method)
+
+    presorted = samples is not None
+    if samples is None:
+        samples = zsc_sample (image, nsamples)
+    return tuple(zsc_quantiles (samples, fractions, presorted))
+
+def zsc_sorted_sample (image, nsamples=1000, bpmask=None, zmask=None):
+
+    # Return the samples used by zscale, sorted.  They can be kept and
+    # passed to zscale or zsc_interval as 'samples', so that redisplaying
+    # an image with other limits does not sample and sort it again.
+
+    samples = zsc_sample (image, nsamples, bpmask, zmask)
+    samples.sort()
+    return samples
+
+def zsc_quantiles (samples, fractions, presorted=False):
+
+    # Return the quantiles of the samples at the given fractions (within
+    # 0 and 1), interpolated between order statistics as numpy.percentile
+    # does.  Unless the samples are known to be sorted, only the order
+    # statistics needed are put in place: the extremes are found with
+    # min and max, the others each by a partition of the samples which
+    # are left above the previous one.  A single partition with several
+    # kth values is slower than a full sort.
+
+    npix = len(samples)
+    if npix == 0:
+        raise ValueError("No samples")
+    positions = [f * (npix - 1) for f in fractions]
+    lows = [min(int(math.floor(p)), npix - 1) for p in positions]
+    highs = [min(k + 1, npix - 1) for k in lows]
+    if presorted:
+        stats = samples
+    else:
+        stats = {}
+        work = None
+        start = 0
+        for k in sorted(set(lows + highs)):
+            if k == 0:
+                stats[k] = samples.min()
+            elif k == npix - 1:
+                stats[k] = samples.max()
+            elif work is None:
+                work = numpy.partition(samples, k)
+                stats[k] = work[k]
+            else:
+                if k > start:
+                    work[start:].partition(k - start)
+                    stats[k] = work[k]
+                else:
+                    # Next to the previous one: the least of the rest
+                    stats[k] = work[start:].min()
+                    work[start:][work[start:].argmin()] = work[start]
+                    work[start] = stats[k]
+            start = k + 1
+    quantiles = []
+    for p, lo, hi in zip(positions, lows, highs):
+        zlo = stats[lo]
+        if hi == lo or p == lo:
+            quantiles.append(zlo)
+        else:
+            quantiles.append(zlo + (p - lo) * (stats[hi] - zlo))
+    return quantiles
+
 def zsc_sample (image, maxpix, bpmask=None, zmask=None):
 
     # Figure out which pixels to use for the zscale algorithm
@@ -75,11 +488,32 @@ def zsc_sample (image, maxpix, bpmask=None, zmask=None):
     nl = image.shape[1]
     stride = max (1.0, math.sqrt((nc - 1) * (nl - 1) / float(maxpix)))
     stride = int (stride)
-    samples = image[::stride,::stride].flatten()
+    if isinstance(image, numpy.ndarray):
+        samples = image[::stride,::stride].flatten()
+        return samples[:maxpix]
+
+    # Array-like objects which are read lazily (memory mapped files,
+    # HDF5 datasets...) are only asked for the sampled rows, up to the
+    # row which completes maxpix samples.
+    rows = []
+    npix = 0
+    for line in range(0, nc, stride):
+        if npix >= maxpix:
+            break
+        rows.append(numpy.asarray(image[line,::stride]).ravel())
+        npix += len(rows[-1])
+    samples = numpy.concatenate(rows)
     return samples[:maxpix]
 
 def zsc_fit_line (samples, npix, krej, ngrow, maxiter):
 
+    # Fit a straight line to the sorted samples, iteratively rejecting the
+    # pixels further than krej sigma from the line, and their neighbours
+    # (ngrow pixels around each of them).  The pixels are selected with
+    # boolean masks and copied into preallocated buffers, so the sums are
+    # computed from exactly the same values, in the same order, as with
+    # index arrays, and give exactly the same fit.
+
     #
     # First re-map indices from -1.0 to 1.0
     xscale = 2.0 / (npix - 1)
@@ -89,9 +523,27 @@ def zsc_fit_line (samples, npix, krej, ngrow, maxiter):
     ngoodpix = npix
     minpix = max (MIN_NPIXELS, int (npix*MAX_REJECT))
     last_ngoodpix = npix + 1
-
-    # This is the mask used in k-sigma clipping.  0 is good, 1 is bad
-    badpix = numpy.zeros(npix, dtype="int32")
+    intercept = slope = 0.0
+
+    # This is the mask used in k-sigma clipping (True for rejected pixels),
+    # and the work buffers
+    badpix = numpy.zeros(npix, dtype=bool)
+    goodpix = numpy.ones(npix, dtype=bool)
+    cutpix = numpy.empty(npix, dtype=bool)
+    xgood = numpy.empty(npix, dtype=numpy.float64)
+    ygood = numpy.empty(npix, dtype=samples.dtype)
+    prod = numpy.empty(npix, dtype=numpy.float64)
+    flat = numpy.empty(npix, dtype=numpy.float64)
+
+    # Rejected pixels are grown to the window [i - ngrow//2, i + (ngrow-1)//2]
+    # around them (as by a convolution with a kernel of length ngrow); the
+    # number of rejected pixels in each window is found from the cumulative
+    # sum of the mask.
+    nbad = numpy.zeros(npix + 1, dtype=numpy.intp)
+    index = numpy.arange(npix)
+    whi = numpy.minimum(index + (ngrow - 1) // 2 + 1, npix)
+    wlo = numpy.maximum(index - ngrow // 2, 0)
+    wcount = numpy.empty(npix, dtype=numpy.intp)
 
     #
     #  Iterate
@@ -102,12 +554,16 @@ def zsc_fit_line (samples, npix, krej, ngrow, maxiter):
             break
 
         # Accumulate sums to calculate straight line fit
-        goodpixels = numpy.where(badpix == GOOD_PIXEL)
-        sumx = xnorm[goodpixels].sum()
-        sumxx = (xnorm[goodpixels]*xnorm[goodpixels]).sum()
-        sumxy = (xnorm[goodpixels]*samples[goodpixels]).sum()
-        sumy = samples[goodpixels].sum()
-        sum = len(goodpixels[0])
+        xg = xgood[:ngoodpix]
+        yg = ygood[:ngoodpix]
+        pg = prod[:ngoodpix]
+        numpy.compress(goodpix, xnorm, out=xg)
+        numpy.compress(goodpix, samples, out=yg)
+        sumx = xg.sum()
+        sumxx = numpy.multiply(xg, xg, out=pg).sum()
+        sumxy = numpy.multiply(xg, yg, out=pg).sum()
+        sumy = yg.sum()
+        sum = ngoodpix
 
         delta = sum * sumxx - sumx * sumx
         # Slope and intercept
@@ -115,28 +571,128 @@ def zsc_fit_line (samples, npix, krej, ngrow, maxiter):
         slope = (sum * sumxy - sumx * sumy) / delta
 
         # Subtract fitted line from the data array
-        fitted = xnorm*slope + intercept
-        flat = samples - fitted
+        numpy.multiply(xnorm, slope, out=flat)
+        flat += intercept
+        numpy.subtract(samples, flat, out=flat)
 
         # Compute the k-sigma rejection threshold
-        ngoodpix, mean, sigma = zsc_compute_sigma (flat, badpix, npix)
+        fg = prod[:ngoodpix]
+        numpy.compress(goodpix, flat, out=fg)
+        sumz = fg.sum()
+        sumsq = numpy.multiply(fg, fg, out=fg).sum()
+        mean, sigma = _zsc_sigma(ngoodpix, sumz, sumsq)
 
         threshold = sigma * krej
 
         # Detect and reject pixels further than k*sigma from the fitted line
         lcut = -threshold
         hcut = threshold
-        below = numpy.where(flat < lcut)
-        above = numpy.where(flat > hcut)
+        badpix |= numpy.less(flat, lcut, out=cutpix)
+        badpix |= numpy.greater(flat, hcut, out=cutpix)
+
+        # Grow the rejected pixels
+        numpy.cumsum(badpix, out=nbad[1:])
+        numpy.subtract(nbad[whi], nbad[wlo], out=wcount)
+        numpy.greater(wcount, 0, out=badpix)
+        numpy.logical_not(badpix, out=goodpix)
+
+        ngoodpix = npix - numpy.count_nonzero(badpix)
+
+        niter += 1
+
+    # Transform the line coefficients back to the X range [0:npix-1]
+    zstart = intercept - slope
+    zslope = slope * xscale
+
+    return ngoodpix, zstart, zslope
+
+def zsc_fit_lines (samples, npix, krej, ngrow, maxiter):
+
+    # Fit a straight line to each row of a 2-d array of sorted samples,
+    # as zsc_fit_line does for one row.  Each row has its own rejection
+    # mask, and stops being fitted once too few of its pixels are left.
+
+    nrows = samples.shape[0]
+
+    #
+    # First re-map indices from -1.0 to 1.0
+    xscale = 2.0 / (npix - 1)
+    xnorm = numpy.arange(npix)
+    xnorm = xnorm * xscale - 1.0
+    xxnorm = xnorm * xnorm
 
-        badpix[below] = BAD_PIXEL
-        badpix[above] = BAD_PIXEL
+    ngoodpix = numpy.empty(nrows, dtype=numpy.intp)
+    ngoodpix[:] = npix
+    minpix = max (MIN_NPIXELS, int (npix*MAX_REJECT))
+    intercept = numpy.zeros(nrows)
+    slope = numpy.zeros(nrows)
+
+    # This is the mask used in k-sigma clipping (True for rejected
+    # pixels), as 0 and 1 weights for the sums over the good pixels
+    badpix = numpy.zeros((nrows, npix), dtype=bool)
+    weight = numpy.empty((nrows, npix), dtype=numpy.float64)
+    flat = numpy.empty((nrows, npix), dtype=numpy.float64)
+    prod = numpy.empty((nrows, npix), dtype=numpy.float64)
+
+    # Rejected pixels are grown as in zsc_fit_line
+    nbad = numpy.zeros((nrows, npix + 1), dtype=numpy.intp)
+    index = numpy.arange(npix)
+    whi = numpy.minimum(index + (ngrow - 1) // 2 + 1, npix)
+    wlo = numpy.maximum(index - ngrow // 2, 0)
 
-        # Convolve with a kernel of length ngrow
-        kernel = numpy.ones(ngrow,dtype="int32")
-        badpix = numpy.convolve(badpix, kernel, mode='same')
+    #
+    #  Iterate
 
-        ngoodpix = len(numpy.where(badpix == GOOD_PIXEL)[0])
+    for niter in range(maxiter):
+
+        active = ngoodpix >= minpix
+        if not active.any():
+            break
+
+        # Accumulate sums to calculate straight line fits
+        numpy.logical_not(badpix, out=weight, casting='unsafe')
+        sum = ngoodpix.astype(numpy.float64)
+        sumx = numpy.dot(weight, xnorm)
+        sumxx = numpy.dot(weight, xxnorm)
+        numpy.multiply(weight, samples, out=prod)
+        sumy = prod.sum(axis=1)
+        sumxy = numpy.dot(prod, xnorm)
+
+        delta = sum * sumxx - sumx * sumx
+        delta[~active] = 1.
+        # Slope and intercept of the rows still being fitted
+        intercept = numpy.where(active, (sumxx * sumy - sumx * sumxy) / delta,
+                                intercept)
+        slope = numpy.where(active, (sum * sumxy - sumx * sumy) / delta, slope)
+
+        # Subtract fitted lines from the data array
+        numpy.multiply(slope[:, None], xnorm, out=flat)
+        flat += intercept[:, None]
+        numpy.subtract(samples, flat, out=flat)
+
+        # Compute the k-sigma rejection thresholds
+        numpy.multiply(flat, weight, out=prod)
+        sumz = prod.sum(axis=1)
+        prod *= flat
+        sumsq = prod.sum(axis=1)
+        ngood = numpy.maximum(sum, 2.)
+        temp = sumsq / (ngood - 1) - sumz * sumz / (ngood * (ngood - 1))
+        sigma = numpy.sqrt(numpy.maximum(temp, 0.))
+
+        threshold = sigma * krej
+
+        # Detect and reject pixels further than k*sigma from the fitted
+        # lines, in the rows still being fitted
+        cut = numpy.abs(flat) > threshold[:, None]
+        cut &= active[:, None]
+        badpix |= cut
+
+        # Grow the rejected pixels
+        numpy.cumsum(badpix, axis=1, out=nbad[:, 1:])
+        numpy.copyto(badpix, nbad[:, whi] > nbad[:, wlo],
+                     where=active[:, None])
+
+        ngoodpix = npix - numpy.count_nonzero(badpix, axis=1)
 
         niter += 1
 
@@ -146,16 +702,191 @@ def zsc_fit_line (samples, npix, krej, ngrow, maxiter):
 
     return ngoodpix, zstart, zslope
 
-def zsc_compute_sigma (flat, badpix, npix):
+def zsc_histogram_dtype (dtype):
 
-    # Compute the rms deviation from the mean of a flattened array.
-    # Ignore rejected pixels
+    # True for the integer types which zsc_histogram accepts
+
+    dtype = numpy.dtype(dtype)
+    return dtype.kind in 'ui' and dtype.itemsize <= 2
+
+def zsc_histogram (image, nthreads=None):
+
+    # Return the sorted distinct values of an 8 or 16 bit integer array
+    # (or array-like image, which is only sliced) and the number of pixels
+    # with each value.  The values are counted by numpy.bincount, over
+    # tiles of rows (in the shared thread pool for large images), so
+    # that only one tile at a time is converted to indices.
+
+    dtype = numpy.dtype(image.dtype)
+    if not zsc_histogram_dtype (dtype):
+        raise ValueError("Histograms need 8 or 16 bit integers, not %s" %
+                         dtype)
+    offset = int(numpy.iinfo(dtype).min)
+    nbins = 1 << (8 * dtype.itemsize)
+
+    def _tilecounts(tile):
+        _sec = numpy.asarray(image[tile[0]:tile[1]]).astype(numpy.intp)
+        if offset:
+            _sec -= offset
+        return numpy.bincount(_sec.ravel(), minlength=nbins)
+
+    hist = None
+    for _counts in tiles.maptiles(_tilecounts, tiles.rowtiles(image.shape),
+                                  nthreads, int(numpy.prod(image.shape))):
+        if hist is None:
+            hist = _counts
+        else:
+            hist += _counts
+    values = numpy.flatnonzero(hist)
+    counts = hist[values]
+    return values + offset, counts
+
+def _zsc_xsums (k, xscale):
+
+    # Sums of x and x**2 over the pixels [0:k] of the sorted samples,
+    # where pixel i has x = i * xscale - 1
+
+    k = numpy.asarray(k, dtype=numpy.float64)
+    sumi = k * (k - 1) / 2
+    sumii = (k - 1) * k * (2 * k - 1) / 6
+    return xscale * sumi - k, xscale * xscale * sumii - 2 * xscale * sumi + k
+
+def zsc_fit_histogram (values, counts, krej, ngrow, maxiter):
+
+    # Fit a straight line to the sorted samples given by their distinct
+    # values and counts, rejecting pixels as zsc_fit_line does.  The
+    # sorted samples are runs of equal values: the sums over the good
+    # pixels are found from closed forms over each run, and the rejected
+    # pixels are kept as intervals of indices, so the cost depends on
+    # the number of distinct values rather than of pixels.  Within a run
+    # the residuals from the line are monotonic, and the pixels within
+    # the threshold are the interval of indices found by solving for
+    # the index.
+
+    counts = numpy.asarray(counts, dtype=numpy.intp)
+    ends = numpy.cumsum(counts)
+    starts = ends - counts
+    npix = int(ends[-1])
+    # The values are offset by their median, to keep the sums of squares
+    # small
+    v0 = float(values[numpy.searchsorted(ends, (npix - 1) // 2, 'right')])
+    vals = numpy.asarray(values, dtype=numpy.float64) - v0
+
+    xscale = 2.0 / (npix - 1)
+
+    # Sums up to the start of each run, for prefix sums of any pixel
+    xstart = _zsc_xsums (starts, xscale)[0]
+    xend = _zsc_xsums (ends, xscale)[0]
+    sumy_run = numpy.concatenate(([0.], numpy.cumsum(vals * counts)))
+    sumyy_run = numpy.concatenate(([0.], numpy.cumsum(vals * vals * counts)))
+    sumxy_run = numpy.concatenate(([0.], numpy.cumsum(vals * (xend - xstart))))
+
+    def _prefix(k):
+        # Sums of x, x**2, y, y**2 and x*y over the pixels [0:k]
+        j = numpy.searchsorted(ends, k, 'right')
+        j = numpy.minimum(j, len(vals) - 1)
+        sx, sxx = _zsc_xsums (k, xscale)
+        inrun = k - starts[j]
+        return (sx, sxx,
+                sumy_run[j] + vals[j] * inrun,
+                sumyy_run[j] + vals[j] * vals[j] * inrun,
+                sumxy_run[j] + vals[j] * (sx - xstart[j]))
+
+    ngoodpix = npix
+    minpix = max (MIN_NPIXELS, int (npix*MAX_REJECT))
+    last_ngoodpix = npix + 1
+    intercept = slope = 0.0
+
+    # Rejected pixels, as sorted disjoint intervals [badlo, badhi)
+    badlo = numpy.zeros(0, dtype=numpy.intp)
+    badhi = numpy.zeros(0, dtype=numpy.intp)
+
+    #
+    #  Iterate
+
+    for niter in range(maxiter):
+
+        if (ngoodpix >= last_ngoodpix) or (ngoodpix < minpix):
+            break
+
+        # Accumulate sums over the intervals of good pixels
+        goodlo = numpy.concatenate(([0], badhi))
+        goodhi = numpy.concatenate((badlo, [npix]))
+        lo = _prefix(goodlo)
+        hi = _prefix(goodhi)
+        sumx, sumxx, sumy, sumyy, sumxy = [(h - l).sum()
+                                           for l, h in zip(lo, hi)]
+        sum = ngoodpix
+
+        delta = sum * sumxx - sumx * sumx
+        # Slope and intercept
+        intercept = (sumxx * sumy - sumx * sumxy) / delta
+        slope = (sum * sumxy - sumx * sumy) / delta
+
+        # Sums of the residuals from the line, and of their squares
+        sumz = sumy - intercept * sum - slope * sumx
+        sumsq = (sumyy - 2 * intercept * sumy - 2 * slope * sumxy +
+                 intercept * intercept * sum + 2 * intercept * slope * sumx +
+                 slope * slope * sumxx)
+        mean, sigma = _zsc_sigma (ngoodpix, sumz, sumsq)
+
+        threshold = sigma * krej
+
+        # Indices [ilo, ihi) of the pixels of each run within the
+        # threshold: |v - intercept - slope * x| <= threshold
+        if slope != 0:
+            xa = (vals - intercept - threshold) / slope
+            xb = (vals - intercept + threshold) / slope
+            ilo = (numpy.minimum(xa, xb) + 1) / xscale
+            ihi = (numpy.maximum(xa, xb) + 1) / xscale
+            ilo = numpy.ceil(numpy.clip(ilo, -1, npix + 1)).astype(numpy.intp)
+            ihi = numpy.floor(numpy.clip(ihi, -2, npix)).astype(numpy.intp) + 1
+        else:
+            within = numpy.abs(vals - intercept) <= threshold
+            ilo = numpy.where(within, starts, ends)
+            ihi = ends
+        oklo = numpy.clip(ilo, starts, ends)
+        okhi = numpy.clip(ihi, oklo, ends)
+
+        # Reject the pixels outside of the threshold, at the start and end
+        # of each run, and grow all the rejected pixels
+        badlo = numpy.concatenate((badlo, starts, okhi))
+        badhi = numpy.concatenate((badhi, oklo, ends))
+        keep = badlo < badhi
+        badlo = numpy.maximum(badlo[keep] - (ngrow - 1) // 2, 0)
+        badhi = numpy.minimum(badhi[keep] + ngrow // 2, npix)
+        badlo, badhi = _zsc_merge (badlo, badhi)
+
+        ngoodpix = npix - int((badhi - badlo).sum())
+
+        niter += 1
+
+    # Transform the line coefficients back to the X range [0:npix-1]
+    zstart = intercept - slope + v0
+    zslope = slope * xscale
+
+    return ngoodpix, zstart, zslope
+
+def _zsc_merge (lo, hi):
+
+    # Merge intervals [lo, hi) into sorted disjoint intervals
+
+    if len(lo) == 0:
+        return lo, hi
+    order = numpy.argsort(lo, kind='mergesort')
+    lo = lo[order]
+    hi = numpy.maximum.accumulate(hi[order])
+    first = numpy.ones(len(lo), dtype=bool)
+    first[1:] = lo[1:] > hi[:-1]
+    last = numpy.ones(len(lo), dtype=bool)
+    last[:-1] = first[1:]
+    return lo[first], hi[last]
+
+def _zsc_sigma (ngoodpix, sumz, sumsq):
+
+    # Mean and rms deviation from the sums of ngoodpix values and of
+    # their squares
 
-    # Accumulate sum and sum of squares
-    goodpixels = numpy.where(badpix == GOOD_PIXEL)
-    sumz = flat[goodpixels].sum()
-    sumsq = (flat[goodpixels]*flat[goodpixels]).sum()
-    ngoodpix = len(goodpixels[0])
     if ngoodpix == 0:
         mean = None
         sigma = None
@@ -169,5 +900,18 @@ def zsc_compute_sigma (flat, badpix, npix):
             sigma = 0.0
         else:
             sigma = math.sqrt (temp)
+    return mean, sigma
+
+def zsc_compute_sigma (flat, badpix, npix):
+
+    # Compute the rms deviation from the mean of a flattened array.
+    # Ignore rejected pixels
+
+    # Accumulate sum and sum of squares
+    goodflat = flat[badpix == GOOD_PIXEL]
+    sumz = goodflat.sum()
+    sumsq = (goodflat*goodflat).sum()
+    ngoodpix = len(goodflat)
+    mean, sigma = _zsc_sigma(ngoodpix, sumz, sumsq)
 
     return ngoodpix, mean, sigma